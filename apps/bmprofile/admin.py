@@ -8,7 +8,10 @@ class BmProfileAdmin(admin.ModelAdmin):
     actions = ['allow_api', 'disallow_api']
 
     def allow_api(self, request, queryset):
+      user_ids = list(queryset.values_list('user', flat=True))
       rows_updated=queryset.update(api_allowed=True)
+      # update() doesn't send post_save
+      BmProfile.objects.forget_api_allowed(user_ids)
       if rows_updated == 1:
           message_bit = "1 profile was"
       else:
@@ -17,7 +20,10 @@ class BmProfileAdmin(admin.ModelAdmin):
     allow_api.short_description = "Allow selected profiles to use the extended API"
 
     def disallow_api(self, request, queryset):
+      user_ids = list(queryset.values_list('user', flat=True))
       rows_updated=queryset.update(api_allowed=False)
+      # update() doesn't send post_save
+      BmProfile.objects.forget_api_allowed(user_ids)
       if rows_updated == 1:
           message_bit = "1 profile was"
       else:
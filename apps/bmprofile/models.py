@@ -1,6 +1,8 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
 from django.conf import settings
+from keyedcache import NotCachedError, cache_delete, cache_get, cache_set
 from signedauth.models import UserKey
 
 import logging
@@ -16,6 +18,33 @@ class BmProfileManager(models.Manager):
             profile.save()
         return profile
 
+    def api_allowed(self, user):
+        """Whether `user` may write through the API, cached until their profile changes.
+
+        On a miss the profile is read with its user and key in one query, and
+        kept as the user's profile.  Users without one are not allowed.
+        """
+        try:
+            # raised with the cache off whatever the default, so none is given
+            return cache_get('bmprofile', 'api_allowed', user.pk)
+        except NotCachedError:
+            pass
+
+        try:
+            profile = self.select_related('user', 'userkey').get(user=user)
+        except BmProfile.DoesNotExist:
+            return False
+
+        user._profile_cache = profile
+        allowed = bool(profile.api_allowed)
+        cache_set('bmprofile', 'api_allowed', user.pk, value=allowed)
+        return allowed
+
+    def forget_api_allowed(self, user_ids):
+        """Drop the cached API permission of `user_ids`, for changes made without saving."""
+        for user_id in user_ids:
+            cache_delete('bmprofile', 'api_allowed', user_id)
+
 class BmProfile(models.Model):
     user = models.ForeignKey(User)
     playaname = models.CharField(max_length=100, default = '', blank=True)
@@ -37,18 +66,23 @@ class BmProfile(models.Model):
     def save(self, *args, **kwargs):
         if not self.playaname:
             self.playaname = self.user.username
-        super(BmProfile, self).save()
-        if not self.userkey:
+        if not self.userkey_id:
             log.debug('creating userkey for %s', self.user.username)
             key = UserKey(label='key', user=self.user)
             key.save()
             self.userkey = key
-            self.save()
+        super(BmProfile, self).save(*args, **kwargs)
 
 
     def __unicode__(self):
         return u'BmProfile: %s' % self.playaname
 
+def forget_api_allowed(sender, instance, **kwargs):
+    BmProfile.objects.forget_api_allowed([instance.user_id])
+
+post_save.connect(forget_api_allowed, sender=BmProfile)
+post_delete.connect(forget_api_allowed, sender=BmProfile)
+
 # maybe monkeypatch user to use BmProfile as its profile without forcing all users to have keys
 if settings.AUTH_PROFILE_MODULE == 'bmprofile.BmProfile':
     User.profile = property(lambda u: BmProfile.objects.force_for_user(u))
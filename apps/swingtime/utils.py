@@ -2,7 +2,6 @@
 Common features and functions for swingtime
 
 '''
-from collections import defaultdict
 from datetime import datetime, date, time, timedelta
 import itertools
 
@@ -55,15 +54,24 @@ def css_class_cycler():
     iterable or cycle of CSS class names.
     
     '''
-    from swingtime.models import EventType
-    return defaultdict(
-        lambda: itertools.cycle(('evt-even', 'evt-odd')).next,
-        ((e.abbr, itertools.cycle((
-             'evt-%s-even' % e.abbr, 
-             'evt-%s-odd' % e.abbr
-             )).next) for e in EventType.objects.all()
-        )
-    )
+    return _CSSClassCycles()
+
+
+#===============================================================================
+class _CSSClassCycles(dict):
+    '''
+    The cycle of an abbreviation is made the first time it is asked for,
+    rather than for all the ``EventType``s up front, which took a query for
+    every column of a timeslot table.
+    '''
+    
+    #---------------------------------------------------------------------------
+    def __missing__(self, abbr):
+        cycle = self[abbr] = itertools.cycle((
+            'evt-%s-even' % abbr, 
+            'evt-%s-odd' % abbr
+        )).next
+        return cycle
 
 
 #===============================================================================
@@ -151,7 +159,7 @@ def create_timeslot_table(
     if isinstance(items, QuerySet):
         items = items._clone()
     elif not items:
-        items = Occurrence.objects.daily_occurrences(dt).select_related('event')
+        items = Occurrence.objects.daily_occurrences(dt).select_related('event__event_type')
 
     # build a mapping of timeslot "buckets"
     timeslots = dict()
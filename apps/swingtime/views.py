@@ -38,7 +38,7 @@ def event_listing(
         all values passed in via **extra_context
     '''
     if not events:
-        events = Event.objects.all()
+        events = Event.objects.select_related('event_type')
     elif hasattr(events, '_clone'):
         events = events._clone()
         
@@ -1,4 +1,6 @@
+from datetime import datetime
 from django.contrib import admin
+from playaevents.caching import invalidate_year
 from playaevents.models import Year, CircularStreet, TimeStreet, ThemeCamp, ArtInstallation, PlayaEvent
 from swingtime.admin import EventNoteInline, OccurrenceInline
 
@@ -38,8 +40,18 @@ class PlayaEventAdmin(admin.ModelAdmin):
     inlines = [EventNoteInline, OccurrenceInline]
 
     actions = ['make_accepted', 'make_rejected', 'make_unmoderated']
+
+    def _moderate(self, queryset, moderation):
+      # queryset.update() bypasses the post_save signals.  The years are
+      # read first, a queryset filtered on moderation matches nothing after.
+      year_ids = set(queryset.values_list('year', flat=True))
+      rows_updated = queryset.update(moderation=moderation, modified=datetime.now())
+      for year_id in year_ids:
+          invalidate_year(year_id)
+      return rows_updated
+
     def make_accepted(self, request, queryset):
-      rows_updated=queryset.update(moderation='A')
+      rows_updated=self._moderate(queryset, 'A')
       if rows_updated == 1:
           message_bit = "1 event was"
       else:
@@ -48,7 +60,7 @@ class PlayaEventAdmin(admin.ModelAdmin):
     make_accepted.short_description = "Moderate selected events as accepted"
 
     def make_rejected(self, request, queryset):
-      rows_updated=queryset.update(moderation='R')
+      rows_updated=self._moderate(queryset, 'R')
       if rows_updated == 1:
           message_bit = "1 event was"
       else:
@@ -57,7 +69,7 @@ class PlayaEventAdmin(admin.ModelAdmin):
     make_rejected.short_description = "Moderate selected events as rejected"
 
     def make_unmoderated(self, request, queryset):
-      rows_updated=queryset.update(moderation='U')
+      rows_updated=self._moderate(queryset, 'U')
       if rows_updated == 1:
           message_bit = "1 event was"
       else:
@@ -0,0 +1,271 @@
+"""
+Offline SQLite bundles of a year, for the apps.
+
+A bundle is a self-contained SQLite file with what the anonymous API shows of
+a year: its events with their occurrences, camps, art and streets, indexed,
+and with full text search tables for events, camps and art.
+
+Like the snapshots (see `playaevents.api.snapshots`), bundles are named after
+the year's cache generation and written under API_BUNDLE_DIR, next to a
+gzipped copy.  They are built by the first request after a change to the
+year, single-flight, or ahead with `manage.py build_bundles`, and served as
+files; with API_BUNDLE_URL set the request is redirected to the web server
+serving that directory instead.
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import time
+from django.conf import settings
+from django.core.servers.basehttp import FileWrapper
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.utils.http import parse_etags
+from keyedcache import cache_enabled, cache_key
+from playaevents.caching import acquire_lease, year_generation, year_id
+from playaevents.models import CircularStreet, TimeStreet, ThemeCamp, ArtInstallation, PlayaEvent
+from swingtime.models import Occurrence
+import logging
+
+log = logging.getLogger(__name__)
+
+# None turns bundles off
+BUNDLE_DIR = getattr(settings, 'API_BUNDLE_DIR', None)
+# where the web server serves BUNDLE_DIR, if it does
+BUNDLE_URL = getattr(settings, 'API_BUNDLE_URL', None)
+
+# bumped when the tables change, apps can check it in the meta table
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+
+CREATE TABLE circular_street (
+    id INTEGER PRIMARY KEY, name TEXT, "order" INTEGER, distance_from_center INTEGER);
+CREATE TABLE time_street (
+    id INTEGER PRIMARY KEY, hour INTEGER, minute INTEGER, name TEXT);
+
+CREATE TABLE camp (
+    id INTEGER PRIMARY KEY, name TEXT, description TEXT, url TEXT, contact_email TEXT);
+CREATE INDEX camp_name ON camp (name);
+
+CREATE TABLE art (
+    id INTEGER PRIMARY KEY, name TEXT, slug TEXT, artist TEXT, description TEXT, url TEXT,
+    contact_email TEXT, circular_street_id INTEGER, time_address TEXT, distance INTEGER,
+    location_string TEXT);
+CREATE INDEX art_name ON art (name);
+
+CREATE TABLE event (
+    id INTEGER PRIMARY KEY, title TEXT, description TEXT, print_description TEXT, slug TEXT,
+    event_type TEXT, event_type_label TEXT, hosted_by_camp_id INTEGER, located_at_art_id INTEGER,
+    other_location TEXT, check_location INTEGER, url TEXT, all_day INTEGER);
+CREATE INDEX event_camp ON event (hosted_by_camp_id);
+CREATE INDEX event_art ON event (located_at_art_id);
+CREATE INDEX event_type ON event (event_type);
+
+CREATE TABLE occurrence (
+    event_id INTEGER NOT NULL, start_time TEXT NOT NULL, end_time TEXT NOT NULL);
+CREATE INDEX occurrence_event ON occurrence (event_id);
+CREATE INDEX occurrence_time ON occurrence (start_time, end_time);
+"""
+
+# full text search, the docid is the id of the row searched
+FTS_TABLES = (
+    ('event_search', 'event', ('title', 'description', 'print_description')),
+    ('camp_search', 'camp', ('name', 'description')),
+    ('art_search', 'art', ('name', 'artist', 'description')),
+    )
+
+def bundle_path(year_id, generation):
+    return os.path.join(BUNDLE_DIR, 'playaevents-%s-%s.sqlite' % (year_id, generation))
+
+def _plain(value):
+    # sqlite3 adapts dates and datetimes, but not times
+    if isinstance(value, time):
+        return value.isoformat()
+    return value
+
+def _rows(queryset, *fields):
+    for row in queryset.values_list(*fields).order_by().iterator():
+        yield tuple(map(_plain, row))
+
+def _fts(db):
+    """The best full text search module this sqlite has."""
+    for module in ('fts4', 'fts3'):
+        try:
+            db.execute('CREATE VIRTUAL TABLE fts_probe USING %s (x)' % module)
+            db.execute('DROP TABLE fts_probe')
+            return module
+        except sqlite3.OperationalError:
+            pass
+    return None
+
+def write_bundle(path, year_year, pk, generation):
+    """Write the bundle of the year `year_year` (pk `pk`) to the new file `path`."""
+    db = sqlite3.connect(path)
+    try:
+        db.executescript(SCHEMA)
+        db.executemany('INSERT INTO meta VALUES (?, ?)', (
+            ('schema_version', str(SCHEMA_VERSION)),
+            ('year', year_year),
+            ('version', str(generation)),
+            ))
+
+        db.executemany('INSERT INTO circular_street VALUES (?, ?, ?, ?)', _rows(
+            CircularStreet.objects.filter(year=pk),
+            'id', 'name', 'order', 'distance_from_center'))
+        db.executemany('INSERT INTO time_street VALUES (?, ?, ?, ?)', _rows(
+            TimeStreet.objects.filter(year=pk),
+            'id', 'hour', 'minute', 'name'))
+
+        # the rows and fields the anonymous API sends
+        db.executemany('INSERT INTO camp VALUES (?, ?, ?, ?, ?)', _rows(
+            ThemeCamp.objects.filter(year=pk),
+            'id', 'name', 'description', 'url', 'contact_email'))
+        db.executemany('INSERT INTO art VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', _rows(
+            ArtInstallation.objects.filter(year=pk),
+            'id', 'name', 'slug', 'artist', 'description', 'url', 'contact_email',
+            'circular_street', 'time_address', 'distance', 'location_string'))
+
+        events = PlayaEvent.objects.filter(year=pk, moderation='A', list_online=True)
+        db.executemany('INSERT INTO event VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', _rows(
+            events,
+            'id', 'title', 'description', 'print_description', 'slug',
+            'event_type__abbr', 'event_type__label', 'hosted_by_camp', 'located_at_art',
+            'other_location', 'check_location', 'url', 'all_day'))
+        db.executemany('INSERT INTO occurrence VALUES (?, ?, ?)', _rows(
+            Occurrence.objects.filter(event__in=events.values('pk')),
+            'event', 'start_time', 'end_time'))
+
+        module = _fts(db)
+        if module:
+            for table, source, columns in FTS_TABLES:
+                db.execute('CREATE VIRTUAL TABLE %s USING %s (%s)' % (table, module, ', '.join(columns)))
+                db.execute('INSERT INTO %s (docid, %s) SELECT id, %s FROM %s' % (
+                    table, ', '.join(columns), ', '.join(columns), source))
+        else:
+            log.warn('sqlite has no full text search, bundle %s has no search tables', path)
+
+        db.commit()
+        db.execute('VACUUM')
+    finally:
+        db.close()
+
+def _remove_old(pk, keep):
+    prefix = 'playaevents-%s-' % pk
+    for name in os.listdir(BUNDLE_DIR):
+        path = os.path.join(BUNDLE_DIR, name)
+        if name.startswith(prefix) and not path.startswith(keep):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+def build_bundle(year_year):
+    """Write the current bundle of `year_year`, returning its path or None if there is no such year."""
+    pk = year_id(year_year)
+    if pk is None:
+        return None
+
+    if not os.path.isdir(BUNDLE_DIR):
+        os.makedirs(BUNDLE_DIR)
+
+    # read first, a change while we build bumps the generation
+    # and the next request builds again
+    generation = year_generation(pk)
+    path = bundle_path(pk, generation)
+
+    fd, tmp = tempfile.mkstemp(dir=BUNDLE_DIR, prefix='.tmp-')
+    os.close(fd)
+    os.unlink(tmp)
+    try:
+        write_bundle(tmp, year_year, pk, generation)
+        os.chmod(tmp, 0644)
+
+        src = open(tmp, 'rb')
+        gz = gzip.open(tmp + '.gz', 'wb', 9)
+        try:
+            shutil.copyfileobj(src, gz)
+        finally:
+            gz.close()
+            src.close()
+
+        # the plain file last, its presence means both are there
+        os.chmod(tmp + '.gz', 0644)
+        os.rename(tmp + '.gz', path + '.gz')
+        os.rename(tmp, path)
+    finally:
+        for leftover in (tmp, tmp + '.gz'):
+            if os.path.exists(leftover):
+                os.unlink(leftover)
+
+    _remove_old(pk, keep=path)
+    log.debug('built bundle %s', path)
+    return path
+
+def current_bundle(year_year):
+    """The path of the current bundle of `year_year`, built if need be, or None."""
+    pk = year_id(year_year)
+    if pk is None:
+        return None
+
+    generation = year_generation(pk)
+    path = bundle_path(pk, generation)
+    if not os.path.exists(path):
+        lease = acquire_lease(cache_key('bundle', pk, generation))
+        if lease is None:
+            # being built, by the time the app retries it will be there
+            return None
+        try:
+            if not os.path.exists(path):
+                path = build_bundle(year_year)
+        finally:
+            lease.release()
+    return path
+
+def serve_bundle(request, year_year):
+    """Respond with the bundle of `year_year`, or 404/503 when there is none (yet)."""
+    if not (BUNDLE_DIR and cache_enabled()):
+        # without the cache every request would be a new generation
+        return HttpResponse('Bundles are not enabled', status=404, mimetype='text/plain')
+
+    if year_id(year_year) is None:
+        return HttpResponse('Year not found #%s' % year_year, status=404, mimetype='text/plain')
+
+    path = current_bundle(year_year)
+    if path is None:
+        response = HttpResponse('The bundle is being built, try again shortly',
+                                status=503, mimetype='text/plain')
+        response['Retry-After'] = '10'
+        return response
+
+    name = os.path.basename(path)
+    etag = name.rsplit('.', 1)[0]
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = '"%s"' % etag
+        return response
+
+    if BUNDLE_URL:
+        # the file never changes under its name, let the web server send it
+        return HttpResponseRedirect(BUNDLE_URL.rstrip('/') + '/' + name)
+
+    encoding = None
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        path, encoding = path + '.gz', 'gzip'
+
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        # replaced by a newer one since we looked, ask again
+        return HttpResponse(status=503, mimetype='text/plain')
+
+    response = HttpResponse(FileWrapper(f), content_type='application/x-sqlite3')
+    response['Content-Length'] = str(os.fstat(f.fileno()).st_size)
+    response['Content-Disposition'] = 'attachment; filename=%s' % name
+    response['ETag'] = '"%s"' % etag
+    response['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
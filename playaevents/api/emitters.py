@@ -9,30 +9,264 @@ Copyright (c) 2011 Black Rock City LLC. All rights reserved.
 from __future__ import generators
 
 import types, decimal, re, inspect
+import calendar
+import datetime
+import threading
+from operator import attrgetter
 
 from piston.emitters import JSONEmitter
 from piston.utils import HttpStatusCode
+from piston.validate_jsonp import is_valid_jsonp_callback_value
+from django.conf import settings
+from django.core.serializers.json import DateTimeAwareJSONEncoder
 from django.db.models.query import QuerySet
 from django.db.models import Model, permalink
 
 from django.utils.encoding import smart_unicode
 from django.http import HttpResponse
-from keyedcache import cache_set, cache_get, cache_key, NotCachedError
+from keyedcache import cache_key
+from playaevents.api.sparse import narrow, requested_fields
+from playaevents.caching import get_or_compute
+from playaevents.instrumentation import count
+from playaevents.records import Record
 
 try:
     import simplejson
 except ImportError:
     from django.utils import simplejson
 
+try:
+    import msgpack
+except ImportError:
+    # the msgpack format is only offered with it installed
+    msgpack = None
+
 import logging
 
 log = logging.getLogger('playaevents.api.emitters')
 
+# emitted as they are, `smart_unicode(strings_only=True)` leaves them alone
+PLAIN_TYPES = frozenset([unicode, int, long, bool, float, types.NoneType,
+                         datetime.datetime, datetime.date, datetime.time])
+
+# how a plan step reads its field off an instance
+VALUE, METHOD, CALL, RELATED, NESTED, MAYBE = range(6)
+
+class Plan(object):
+    """
+    What `_model` does for one (model, fields, anonymous)
+    combination, worked out once: a list of
+    (name, accessor, kind, argument) steps, and which
+    uris to add.
+    """
+    def __init__(self, steps, resource_uri=None, api_url=False, absolute_uri=False):
+        self.steps = steps
+        self.resource_uri = resource_uri
+        self.api_url = api_url
+        self.absolute_uri = absolute_uri
+
+def _getter(name):
+    return lambda data: getattr(data, name, None)
+
+_plans = { }
+_record_plans = { }
+
+class RenderMemo(object):
+    """
+    Rendered responses, kept under the ETag `ConditionalResource`
+    gives the request, which stands for the handler, the year's
+    cache generation and the full path.  Requests without one
+    are rendered every time.
+
+    Counts its hits and misses, per worker, to show whether it
+    pays for the cache space; see the cache stats view.
+    """
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.unkeyed = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def render(self, request, render):
+        etag = getattr(request, 'api_etag', None)
+        if not (etag and self.timeout):
+            self._count('unkeyed')
+            return render()
+
+        rendered = []
+        def _render():
+            rendered.append(True)
+            return render()
+
+        content = get_or_compute(cache_key('rendered', etag), _render, length=self.timeout)
+        self._count(rendered and 'misses' or 'hits')
+        count(rendered and 'render_misses' or 'render_hits')
+        return content
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'unkeyed' : self.unkeyed,
+                }
+
+render_memo = RenderMemo(getattr(settings, 'API_RENDER_MEMO_TIMEOUT', 60*60))
+
 class TimeAwareJSONEmitter(JSONEmitter):
     """
     JSON emitter, understands timestamps.
+
+    Rather than looking at the typemapper, the model's fields and
+    the handler's methods for every instance, the emitter compiles
+    a `Plan` the first time it meets a model with a given set of
+    fields and reuses it for every other row.
     """
 
+    def plan(self, model, fields=()):
+        """
+        The `Plan` for serializing instances of `model`, or None
+        when there is neither a handler nor fields for it.
+        """
+        if getattr(model, '_deferred', False):
+            # from an only() queryset, it has the fields of its model
+            model = model._meta.proxy_for_model
+
+        try:
+            key = (model, tuple(fields), self.anonymous)
+            return _plans[key]
+        except KeyError:
+            plan = _plans[key] = self.compile_plan(model, fields)
+            return plan
+        except TypeError:
+            # unhashable field spec, don't keep it
+            return self.compile_plan(model, fields)
+
+    def compile_plan(self, model, fields=()):
+        handler = self.in_typemapper(model, self.anonymous)
+        if not (handler or fields):
+            return None
+
+        steps = [ ]
+        get_absolute_uri = False
+
+        if not fields:
+            """
+            Fields was not specified, try to find the correct
+            version in the typemapper we were sent.
+            """
+            get_fields = set(handler.fields)
+            exclude_fields = set(handler.exclude).difference(get_fields)
+
+            if 'absolute_uri' in get_fields:
+                get_absolute_uri = True
+
+            if not get_fields:
+                get_fields = set([ f.attname.replace("_id", "", 1)
+                    for f in model._meta.fields ])
+
+            # sets can be negated.
+            for exclude in exclude_fields:
+                if isinstance(exclude, basestring):
+                    get_fields.discard(exclude)
+
+                elif isinstance(exclude, re._pattern_type):
+                    for field in get_fields.copy():
+                        if exclude.match(field):
+                            get_fields.discard(field)
+
+        else:
+            get_fields = set(fields)
+
+        met_fields = self.method_fields(handler, get_fields)
+
+        for f in model._meta.local_fields:
+            if f.serialize and f.attname not in met_fields:
+                if not f.rel:
+                    if f.attname in get_fields:
+                        steps.append((f.attname, attrgetter(f.attname), VALUE, None))
+                        get_fields.remove(f.attname)
+                else:
+                    if f.attname[:-3] in get_fields:
+                        steps.append((f.name, attrgetter(f.name), VALUE, None))
+                        get_fields.remove(f.name)
+
+        for mf in model._meta.many_to_many:
+            if mf.serialize and mf.attname not in met_fields:
+                if mf.attname in get_fields:
+                    steps.append((mf.name, attrgetter(mf.name), RELATED, ()))
+                    get_fields.remove(mf.name)
+
+        # the remainder of fields
+        for maybe_field in get_fields:
+
+            if isinstance(maybe_field, (list, tuple)):
+                name, subfields = maybe_field
+                steps.append((name, _getter(name), NESTED, subfields))
+
+            elif maybe_field in met_fields:
+                # Overriding normal field which has a "resource method"
+                # so you can alter the contents of certain fields without
+                # using different names.
+                steps.append((maybe_field, None, METHOD, met_fields[maybe_field]))
+
+            else:
+                attr = getattr(model, maybe_field, None)
+                if inspect.ismethod(attr):
+                    # a plain method, the instance can't change that
+                    if len(inspect.getargspec(attr)[0]) == 1:
+                        steps.append((maybe_field, attrgetter(maybe_field), CALL, None))
+                else:
+                    steps.append((maybe_field, _getter(maybe_field), MAYBE, handler))
+
+        resource_uri = None
+        if hasattr(handler, 'resource_uri'):
+            resource_uri = handler.resource_uri()
+
+        return Plan(steps, resource_uri,
+                    api_url=hasattr(model, 'get_api_url') and not resource_uri,
+                    absolute_uri=hasattr(model, 'get_absolute_url') and get_absolute_uri)
+
+    def record_plan(self, record, fields):
+        """
+        The (name, accessor, kind, subfields) steps for
+        serializing `record` instances with `fields`.
+        """
+        try:
+            key = (record, tuple(fields))
+            return _record_plans[key]
+        except KeyError:
+            steps = _record_plans[key] = self.compile_record_plan(record, fields)
+            return steps
+        except TypeError:
+            return self.compile_record_plan(record, fields)
+
+    def compile_record_plan(self, record, fields):
+        steps = [ ]
+        for field in fields:
+            if isinstance(field, (list, tuple)):
+                name, subfields = field
+                steps.append((name, _getter(name), NESTED, subfields))
+            elif field in record._fields:
+                steps.append((field, attrgetter(field), VALUE, None))
+
+        return steps
+
+    def narrow_fields(self, request):
+        """
+        Cut the fields down to those asked for with
+        ?fields=, see `playaevents.api.sparse`.
+        """
+        self.fields = narrow(self.fields, requested_fields(request, self.fields))
+
+    def render(self, request):
+        self.narrow_fields(request)
+        return render_memo.render(request,
+            lambda: super(TimeAwareJSONEmitter, self).render(request))
+
     def construct(self):
         """
         Recursively serialize a lot of types, and
@@ -41,14 +275,27 @@ class TimeAwareJSONEmitter(JSONEmitter):
 
         Returns `dict`.
         """
+        # Kickstart the seralizin'.
+        return self.serializer()(self.data, self.fields)
+
+    def serializer(self):
+        """
+        Returns the function `construct` serializes
+        with, called as `serialize(thing, fields)`.
+        """
         def _any(thing, fields=()):
             """
             Dispatch, all types are routed through here.
             """
+            if type(thing) in PLAIN_TYPES:
+                return thing
+
             ret = None
 
             if isinstance(thing, QuerySet):
                 ret = _qs(thing, fields=fields)
+            elif isinstance(thing, Record):
+                ret = _record(thing, fields=fields)
             elif isinstance(thing, (tuple, list)):
                 ret = _list(thing)
             elif isinstance(thing, dict):
@@ -67,146 +314,114 @@ class TimeAwareJSONEmitter(JSONEmitter):
 
             return ret
 
-        def _fk(data, field):
-            """
-            Foreign keys.
-            """
-            return _any(getattr(data, field.name))
-
         def _related(data, fields=()):
             """
             Foreign keys.
             """
             return [ _model(m, fields) for m in data.iterator() ]
 
-        def _m2m(data, field, fields=()):
-            """
-            Many to many (re-route to `_model`.)
-            """
-            return [ _model(m, fields) for m in getattr(data, field.name).iterator() ]
-
         def _model(data, fields=()):
             """
             Models. Will respect the `fields` and/or
-            `exclude` on the handler (see `typemapper`.)
+            `exclude` on the handler (see `typemapper`),
+            through the plan compiled for their class.
             """
+            plan = self.plan(type(data), fields)
+            if plan is None:
+                return _instance(data)
+
             ret = { }
-            handler = self.in_typemapper(type(data), self.anonymous)
-            get_absolute_uri = False
-
-            if handler or fields:
-                v = lambda f: getattr(data, f.attname)
-
-                if not fields:
-                    """
-                    Fields was not specified, try to find the correct
-                    version in the typemapper we were sent.
-                    """
-                    mapped = self.in_typemapper(type(data), self.anonymous)
-                    get_fields = set(mapped.fields)
-                    exclude_fields = set(mapped.exclude).difference(get_fields)
-
-                    if 'absolute_uri' in get_fields:
-                        get_absolute_uri = True
-
-                    if not get_fields:
-                        get_fields = set([ f.attname.replace("_id", "", 1)
-                            for f in data._meta.fields ])
-
-                    # sets can be negated.
-                    for exclude in exclude_fields:
-                        if isinstance(exclude, basestring):
-                            get_fields.discard(exclude)
-
-                        elif isinstance(exclude, re._pattern_type):
-                            for field in get_fields.copy():
-                                if exclude.match(field):
-                                    get_fields.discard(field)
+            for name, get, kind, arg in plan.steps:
+                if kind == VALUE:
+                    ret[name] = _any(get(data))
+
+                elif kind == METHOD:
+                    ret[name] = _any(arg(data))
+
+                elif kind == CALL:
+                    ret[name] = _any(get(data)())
+
+                elif kind == RELATED:
+                    ret[name] = _related(get(data), arg)
+
+                elif kind == NESTED:
+                    inst = get(data)
+                    if inst:
+                        if hasattr(inst, 'all'):
+                            ret[name] = _related(inst, arg)
+                        elif callable(inst):
+                            if len(inspect.getargspec(inst)[0]) == 1:
+                                ret[name] = _any(inst(), arg)
+                        else:
+                            ret[name] = _model(inst, arg)
 
                 else:
-                    get_fields = set(fields)
+                    maybe = get(data)
+                    if maybe:
+                        if isinstance(maybe, (int, basestring)):
+                            ret[name] = _any(maybe)
+                        elif callable(maybe):
+                            if len(inspect.getargspec(maybe)[0]) == 1:
+                                ret[name] = _any(maybe())
+                    else:
+                        handler_f = getattr(arg or self.handler, name, None)
 
-                met_fields = self.method_fields(handler, get_fields)
+                        if handler_f:
+                            ret[name] = _any(handler_f(data))
 
-                for f in data._meta.local_fields:
-                    if f.serialize and f.attname not in met_fields:
-                        if not f.rel:
-                            if f.attname in get_fields:
-                                ret[f.attname] = _any(v(f))
-                                get_fields.remove(f.attname)
-                        else:
-                            if f.attname[:-3] in get_fields:
-                                ret[f.name] = _fk(data, f)
-                                get_fields.remove(f.name)
-
-                for mf in data._meta.many_to_many:
-                    if mf.serialize and mf.attname not in met_fields:
-                        if mf.attname in get_fields:
-                            ret[mf.name] = _m2m(data, mf)
-                            get_fields.remove(mf.name)
-
-                # try to get the remainder of fields
-                for maybe_field in get_fields:
-
-                    if isinstance(maybe_field, (list, tuple)):
-                        model, fields = maybe_field
-                        inst = getattr(data, model, None)
-
-                        if inst:
-                            if hasattr(inst, 'all'):
-                                ret[model] = _related(inst, fields)
-                            elif callable(inst):
-                                if len(inspect.getargspec(inst)[0]) == 1:
-                                    ret[model] = _any(inst(), fields)
-                            else:
-                                ret[model] = _model(inst, fields)
-
-                    elif maybe_field in met_fields:
-                        # Overriding normal field which has a "resource method"
-                        # so you can alter the contents of certain fields without
-                        # using different names.
-                        ret[maybe_field] = _any(met_fields[maybe_field](data))
+            # resource uri
+            if plan.resource_uri:
+                url_id, fields = plan.resource_uri
+                ret['resource_uri'] = permalink( lambda: (url_id,
+                    (getattr(data, f) for f in fields) ) )()
 
-                    else:
-                        maybe = getattr(data, maybe_field, None)
-                        if maybe:
-                            if isinstance(maybe, (int, basestring)):
-                                ret[maybe_field] = _any(maybe)
-                            elif callable(maybe):
-                                if len(inspect.getargspec(maybe)[0]) == 1:
-                                    ret[maybe_field] = _any(maybe())
-                        else:
-                            handler_f = getattr(handler or self.handler, maybe_field, None)
+            if plan.api_url and 'resource_uri' not in ret:
+                try: ret['resource_uri'] = data.get_api_url()
+                except: pass
 
-                            if handler_f:
-                                ret[maybe_field] = _any(handler_f(data))
+            # absolute uri
+            if plan.absolute_uri:
+                try: ret['absolute_uri'] = data.get_absolute_url()
+                except: pass
 
-            else:
-                for f in data._meta.fields:
-                    ret[f.attname] = _any(getattr(data, f.attname))
+            return ret
 
-                fields = dir(data.__class__) + ret.keys()
-                add_ons = [k for k in dir(data) if k not in fields]
+        def _instance(data):
+            """
+            Models with neither a handler nor fields, everything goes.
+            """
+            ret = { }
+            for f in data._meta.fields:
+                ret[f.attname] = _any(getattr(data, f.attname))
 
-                for k in add_ons:
-                    ret[k] = _any(getattr(data, k))
+            fields = dir(data.__class__) + ret.keys()
+            add_ons = [k for k in dir(data) if k not in fields]
 
-            # resource uri
-            if self.in_typemapper(type(data), self.anonymous):
-                handler = self.in_typemapper(type(data), self.anonymous)
-                if hasattr(handler, 'resource_uri'):
-                    url_id, fields = handler.resource_uri()
-                    ret['resource_uri'] = permalink( lambda: (url_id,
-                        (getattr(data, f) for f in fields) ) )()
+            for k in add_ons:
+                ret[k] = _any(getattr(data, k))
 
             if hasattr(data, 'get_api_url') and 'resource_uri' not in ret:
                 try: ret['resource_uri'] = data.get_api_url()
                 except: pass
 
-            # absolute uri
-            if hasattr(data, 'get_absolute_url') and get_absolute_uri:
-                try: ret['absolute_uri'] = data.get_absolute_url()
-                except: pass
+            return ret
+
+        def _record(data, fields=()):
+            """
+            Cached records (see `playaevents.records`), serialized
+            like the model they stand for. Fields the record
+            doesn't carry are skipped.
+            """
+            ret = { }
+            for name, get, kind, subfields in self.record_plan(type(data), fields or self.fields):
+                if kind == VALUE:
+                    ret[name] = _any(get(data))
+                else:
+                    value = get(data)
+                    if isinstance(value, Record):
+                        ret[name] = _record(value, subfields)
+                    elif value is not None:
+                        ret[name] = [ _record(v, subfields) for v in value ]
 
             return ret
 
@@ -220,30 +435,86 @@ class TimeAwareJSONEmitter(JSONEmitter):
             """
             Lists.
             """
-
-            key = cache_key('jsonx', data)
-            try:
-                ret = cache_get(key)
-                log.debug('got json serialized list from cache for %s', key)
-            except NotCachedError:
-                ret = [ _any(v) for v in data ]
-                log.debug('setting json serialized list to cache for %s', key)
-                cache_set(key, value=ret)
-            return ret
+            return [ _any(v) for v in data ]
 
         def _dict(data):
             """
             Dictionaries.
             """
-            key = cache_key('json', data)
-            try:
-                ret = cache_get(key)
-                log.debug('got json serialized data from cache for %s', key)
-            except NotCachedError:
-                ret = dict([ (k, _any(v)) for k, v in data.iteritems() ])
-                log.debug('setting json serialized data to cache for %s', key)
-                cache_set(key, value=ret)
-            return ret
+            return dict([ (k, _any(v)) for k, v in data.iteritems() ])
 
-        # Kickstart the seralizin'.
-        return _any(self.data, self.fields)
+        return _any
+
+class StreamingJSONEmitter(TimeAwareJSONEmitter):
+    """
+    JSON emitter which writes lists and querysets out
+    a chunk of rows at a time, as the response is sent,
+    instead of building the whole list and the whole
+    string first. Anything else is rendered as usual.
+    """
+    content_type = 'text/javascript; charset=utf-8'
+    chunk_rows = 200
+
+    def render(self, request):
+        if not isinstance(self.data, (list, tuple, QuerySet)):
+            return super(StreamingJSONEmitter, self).render(request)
+
+        return HttpResponse(self.stream_render(request), mimetype=self.content_type)
+
+    def stream_render(self, request, stream=True):
+        self.narrow_fields(request)
+        serialize = self.serializer()
+        encode = DateTimeAwareJSONEncoder(ensure_ascii=False).encode
+
+        if isinstance(self.data, QuerySet):
+            # don't fill the queryset's result cache
+            rows = self.data.iterator()
+            fields = self.fields
+        else:
+            rows = self.data
+            fields = ()
+
+        cb = request.GET.get('callback', None)
+        if cb and is_valid_jsonp_callback_value(cb):
+            head, tail = u'%s([' % cb, u'])'
+        else:
+            head, tail = u'[', u']'
+
+        chunk, chunked = [head], 0
+        for n, row in enumerate(rows):
+            if n:
+                chunk.append(u',')
+            chunk.append(encode(serialize(row, fields)))
+            chunked += 1
+            if chunked == self.chunk_rows:
+                yield u''.join(chunk).encode('utf-8')
+                chunk, chunked = [], 0
+
+        chunk.append(tail)
+        yield u''.join(chunk).encode('utf-8')
+
+def _msgpack_default(obj):
+    """
+    What msgpack can't pack itself. Datetimes, which are
+    naive playa times, become timestamps of that wall clock
+    time read as UTC; dates and times are sent as JSON has them.
+    """
+    if isinstance(obj, datetime.datetime):
+        return msgpack.Timestamp(calendar.timegm(obj.timetuple()), obj.microsecond * 1000)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    raise TypeError('cannot pack %r' % obj)
+
+class MessagePackEmitter(TimeAwareJSONEmitter):
+    """
+    Binary emitter for the mobile apps, the same
+    structure as the JSON one, built with the same
+    plans, packed with msgpack.
+    """
+    content_type = 'application/x-msgpack'
+
+    def render(self, request):
+        self.narrow_fields(request)
+        # all text is unicode or ascii field names, sent as msgpack strings
+        return render_memo.render(request,
+            lambda: msgpack.packb(self.construct(), default=_msgpack_default, use_bin_type=False))
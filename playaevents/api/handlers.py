@@ -1,11 +1,26 @@
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from keyedcache import cache_enabled
 from piston.emitters import Emitter, JSONEmitter
 from piston.handler import BaseHandler, AnonymousBaseHandler
 from piston.utils import rc
+from playaevents.api.lookups import BulkLookups, LookupFailed, QueryLookups, to_pk
+from playaevents.api.paging import is_paged, paginate
+from playaevents.api.permissions import api_allowed
+from playaevents.api.sparse import requested_fields, sparse_queryset, sparse_records
+from playaevents.api.sync import changed_since
 from playaevents.api.utils import rc_response
-from playaevents.api.emitters import TimeAwareJSONEmitter
+from playaevents.api.emitters import TimeAwareJSONEmitter, StreamingJSONEmitter, MessagePackEmitter, msgpack
 from playaevents.models import Year, CircularStreet, ThemeCamp, ArtInstallation, PlayaEvent, TimeStreet
-from swingtime.models import Occurrence, EventType
+from playaevents.caching import deferred_invalidation, year_generation, year_id
+from playaevents.records import event_records, camp_records
+from playaevents.schedule import NEXT_WITHIN, happening
+from swingtime.models import Occurrence
 
 try:
     import json
@@ -16,8 +31,16 @@ import logging
 
 log = logging.getLogger(__name__)
 
+BULK_MAX_ROWS = getattr(settings, 'API_BULK_MAX_ROWS', 5000)
+
+# most minutes ahead the happening resource looks for what's next
+HAPPENING_MAX_WITHIN = 60*24
+
 JSONEmitter.unregister('json')
 Emitter.register('json', TimeAwareJSONEmitter, content_type='text/javascript; charset=utf-8')
+Emitter.register('jsonstream', StreamingJSONEmitter, content_type=StreamingJSONEmitter.content_type)
+if msgpack is not None:
+    Emitter.register('msgpack', MessagePackEmitter, content_type=MessagePackEmitter.content_type)
 
 art_fields = ('id', 'name', ('year', ('id','year')),
               'slug', 'artist', 'description', 'url',
@@ -25,7 +48,8 @@ art_fields = ('id', 'name', ('year', ('id','year')),
               'distance', 'location_string')
 event_fields = ('id', 'title','description',
                 'print_description', ('year', ('id','year')),
-                'slug', 'event_type', ('hosted_by_camp', ('id','name')),
+                'slug', ('event_type', ('abbr','label')),
+                ('hosted_by_camp', ('id','name')),
                 ('located_at_art', ('id','name')),
                 'other_location', 'check_location',
                 'url', 'all_day',
@@ -52,12 +76,147 @@ tstreet_fields = ('id', ('year', ('id','year')),
 year_fields = ('id', 'location', 'participants', 'theme')
 user_fields = ('id', 'username', 'first_name', 'last_name', 'active')
 
-class BaseArtHandler(object):
+TRUE_VALUES = ('1', 'T', 'Y', 'YES', 'TRUE', 'ON')
+
+def _boolean(val):
+    if isinstance(val, bool):
+        return val
+    return unicode(val).upper() in TRUE_VALUES
+
+def _set_fields(obj, data, text_fields, boolean_fields):
+    # text fields
+    for key in text_fields:
+        if key in data:
+            val = data[key]
+            log.debug('setting %s=%s', key, val)
+            setattr(obj, key, val)
+
+    # booleans
+    for key in boolean_fields:
+        if key in data:
+            val = _boolean(data[key])
+            log.debug('setting %s=%s', key, val)
+            setattr(obj, key, val)
+
+def _set_bm_fm_id(obj, data):
+    if 'bm_fm_id' in data:
+        try:
+            obj.bm_fm_id = int(data['bm_fm_id'])
+        except (TypeError, ValueError):
+            raise LookupFailed('Bad bm_fm_id: %s' % data['bm_fm_id'])
+
+def _apply_art(obj, data, lookups):
+    """Update the ArtInstallation `obj` from `data`, raises LookupFailed."""
+    # get rid of illegal-to-update attributes
+    for key in ('id','pk'):
+        if key in data:
+            del data[key]
+
+    if 'year' in data:
+        obj.year = lookups.year(data['year'])
+
+    _set_fields(obj, data,
+                ('description', 'name', 'artist', 'contact_email', 'url', 'slug', 'time_address', 'distance'),
+                ())
+    _set_bm_fm_id(obj, data)
+
+def _new_event(user, data, lookups):
+    log.debug('creating new event')
+    obj = PlayaEvent()
+    obj.creator = user
+    if not 'event_type' in data:
+        obj.event_type = lookups.default_event_type()
+    else:
+        obj.event_type = lookups.event_type(data['event_type'])
+    return obj
+
+def _apply_event(obj, data, lookups):
+    """Update the PlayaEvent `obj` from `data`, raises LookupFailed."""
+    # get rid of illegal-to-update attributes
+    for key in ('id','pk'):
+        if key in data:
+            del data[key]
+
+    if 'year' in data:
+        obj.year = lookups.year(data['year'])
+
+    _set_fields(obj, data,
+                ('print_description', 'url', 'contact_email', 'other_location', 'slug'),
+                ('check_location', 'all_day', 'list_online', 'list_contact_online'))
+
+    # moderation
+    if 'moderation' in data:
+        modkey = unicode(data['moderation']).upper()
+        if modkey in ('U','A','R'):
+            log.debug('setting moderation=%s', modkey)
+            obj.moderation = modkey
+
+    if 'hosted_by_camp' in data:
+        obj.hosted_by_camp = lookups.camp(data['hosted_by_camp'])
+        log.debug('located at camp: %s', obj.hosted_by_camp)
+
+    if 'located_at_art' in data:
+        obj.located_at_art = lookups.art(data['located_at_art'])
+        log.debug('located at art: %s', obj.located_at_art)
+
+def _apply_camp(obj, data, lookups):
+    """Update the ThemeCamp `obj` from `data`, raises LookupFailed."""
+    # get rid of illegal-to-update attributes
+    for key in ('id','pk','deleted'):
+        if key in data:
+            del data[key]
+
+    if 'year' in data:
+        obj.year = lookups.year(data['year'])
+
+    if 'circular_street' in data:
+        obj.circular_street = lookups.circular_street(data['circular_street'])
+    elif 'circular_street_name' in data:
+        obj.circular_street = lookups.circular_street_named(data['circular_street_name'], obj.year_id)
+
+    if 'time_street' in data:
+        street = lookups.time_street(data['time_street'])
+        if street is not None:
+            obj.time_address = street.name
+        else:
+            obj.time_address = data['time_address']
+    elif 'time_street_name' in data:
+        street = lookups.time_street_named(data['time_street_name'], obj.year_id)
+        if street is not None:
+            obj.time_address = street.name
+        else:
+            obj.time_address = data['time_street_name']
+
+    _set_fields(obj, data,
+                ('name','description', 'url', 'hometown', 'location_string', 'slug'),
+                ('list_online',))
+    _set_bm_fm_id(obj, data)
+
+class YearChangeMarker(object):
+    """
+    For handlers whose output only changes with the data of the
+    year they are asked for, or of any year when there is none.
+    The marker is the year's cache generation, see `ConditionalResource`.
+    """
+    def change_marker(self, request, year_year=None, *args, **kwargs):
+        if not cache_enabled():
+            return None
+
+        if not year_year:
+            return year_generation(None)
+
+        pk = year_id(year_year)
+        if pk is None:
+            return None
+        return year_generation(pk)
+
+class BaseArtHandler(YearChangeMarker):
     model = ArtInstallation
     fields = art_fields
 
     def read(self, request, year_year=None, art_id=None):
-        base = ArtInstallation.objects.filter()
+        base = ArtInstallation.objects.select_related('year', 'circular_street__year')
+        base = sparse_queryset(base, requested_fields(request, self.fields))
         if(year_year):
             try:
                 year = Year.objects.get(year=year_year)
@@ -66,6 +225,10 @@ class BaseArtHandler(object):
 
             if art_id:
                 art = base.filter(year=year,id=art_id)
+            elif 'since' in request.GET:
+                art = changed_since(request, base.filter(year=year))
+            elif is_paged(request):
+                art = paginate(request, base.filter(year=year))
             else:
                 art = base.filter(year=year)
             return art
@@ -73,7 +236,7 @@ class BaseArtHandler(object):
             return base.all()
 
 class AnonymousArtInstallationHandler(BaseArtHandler, AnonymousBaseHandler):
-    allow_methods = ('GET',)
+    allowed_methods = ('GET',)
     model = ArtInstallation
 
     def read(self, request, year_year=None, art_id=None):
@@ -82,7 +245,7 @@ class AnonymousArtInstallationHandler(BaseArtHandler, AnonymousBaseHandler):
 
 
 class ArtInstallationHandler(BaseArtHandler, BaseHandler):
-    allow_methods = ('GET','PUT','POST')
+    allowed_methods = ('GET','PUT','POST')
     anonymous = AnonymousArtInstallationHandler
 
     def read(self, request, year_year=None, art_id=None):
@@ -91,7 +254,7 @@ class ArtInstallationHandler(BaseArtHandler, BaseHandler):
 
     def _create_or_update(self, request, year_year=None, art_id=None):
         user = request.user
-        if not user.get_profile().api_allowed:
+        if not api_allowed(request):
             return rc_response(request, rc.BAD_REQUEST, 'User not permitted to use the API')
 
         method = request.method
@@ -137,30 +300,10 @@ class ArtInstallationHandler(BaseArtHandler, BaseHandler):
             log.debug('creating new ArtInstallation')
             obj = ArtInstallation()
 
-        # get rid of illegal-to-update attributes
-        for key in ('id','pk'):
-            if key in data:
-                del data[key]
-
-        # now loop through the data, updating as needed
-        if 'year' in data:
-            try:
-                year = Year.objects.get(year=data['year'])
-            except Year.DoesNotExist:
-                return rc_response(request, rc.NOT_HERE, 'No such year: %s' % data['year'])
-
-            obj.year = year
-
-        # text fields
-        for key in ('description', 'name', 'artist', 'contact_email', 'url', 'slug', 'time_address', 'distance'):
-            if key in data:
-                val = data[key]
-                log.debug('setting %s=%s', key, val)
-                setattr(obj, key, val)
-
-        #bm_fm_id
-        if 'bm_fm_id' in data:
-            obj.bm_fm_id = int(data['bm_fm_id'])
+        try:
+            _apply_art(obj, data, QueryLookups())
+        except LookupFailed, e:
+            return rc_response(request, rc.NOT_HERE, unicode(e))
 
         obj.save()
 
@@ -184,7 +327,43 @@ class ArtInstallationHandler(BaseArtHandler, BaseHandler):
         return self._create_or_update(request, year_year=year_year, art_id=art_id)
 
 
-class BasePlayaEventHandler(object):
+def _time_window(request):
+    """The occurrence filter for ?start_time= and ?end_time=, None without either.
+
+    Events match with an occurrence inside the window, or with ?overlap=true
+    with any occurrence running during it.  Raises ValueError for a bad time.
+    """
+    field = Occurrence._meta.get_field('start_time')
+    times = []
+    for key in ('start_time', 'end_time'):
+        value = request.GET.get(key)
+        if value:
+            try:
+                value = field.to_python(value)
+            except ValidationError:
+                raise ValueError('Invalid %s: %s' % (key, value))
+        times.append(value or None)
+
+    start, end = times
+    if start is None and end is None:
+        return None
+
+    window = {}
+    if _boolean(request.GET.get('overlap', '')):
+        if start is not None:
+            window['occurrence__end_time__gt'] = start
+        if end is not None:
+            window['occurrence__start_time__lt'] = end
+    else:
+        if start is not None:
+            window['occurrence__start_time__gte'] = start
+        if end is not None:
+            window['occurrence__end_time__lte'] = end
+
+    # in one Q, so both times are of the same occurrence
+    return Q(**window)
+
+class BasePlayaEventHandler(YearChangeMarker):
     model = PlayaEvent
 
     def read(self, request, year_year=None, playa_event_id=None, online_only = True):
@@ -198,42 +377,52 @@ class BasePlayaEventHandler(object):
             if online_only:
                 kw['list_online'] = True
 
+            fields = requested_fields(request, self.fields)
+            build = sparse_records(event_records, fields)
+
             if playa_event_id:
                 kw['year'] = year
                 kw['id'] = playa_event_id
-                events = PlayaEvent.objects.filter(*kw)
-
-            else:
-                if(request.GET.get('start_time') and request.GET.get('end_time')):
-                    event_list = Occurrence.objects.filter(start_time__gte=request.GET.get('start_time'), end_time__lte=request.GET.get('end_time')).values_list('event', flat=True)
-
-                    kw['id__in'] = event_list
-                    events = PlayaEvent.objects.filter(**kw)
+                events = build(PlayaEvent.objects.filter(**kw))
 
-                elif(request.GET.get('start_time')):
-                    event_list = Occurrence.objects.filter(start_time__gte=request.GET.get('start_time')).values_list('event', flat=True)
+            elif 'since' in request.GET:
+                # the same rows as the plain list below, the others are tombstones
+                visible = Q(moderation='A', **kw)
+                events = changed_since(request, PlayaEvent.objects.filter(year=year),
+                                       visible, build)
 
-                    kw['id__in'] = event_list
-                    events = PlayaEvent.objects.filter(**kw)
+            else:
+                kw['year'] = year
+                kw['moderation'] = 'A'
 
-                elif(request.GET.get('end_time')):
-                    event_list = Occurrence.objects.filter(end_time__lte=request.GET.get('end_time')).values_list('event', flat=True)
+                try:
+                    window = _time_window(request)
+                except ValueError, e:
+                    return rc_response(request, rc.BAD_REQUEST, unicode(e))
+
+                if window is not None:
+                    # one join, distinct as an event may have several
+                    # occurrences in the window
+                    queryset = PlayaEvent.objects.filter(window, **kw).distinct()
+                else:
+                    queryset = PlayaEvent.objects.filter(**kw)
 
-                    kw['id__in'] = event_list
-                    events = PlayaEvent.objects.filter(**kw)
+                if is_paged(request):
+                    events = paginate(request, queryset, build)
+                elif window is not None:
+                    events = build(queryset)
                 else:
-                    kw['year'] = year
-                    kw['moderation'] = 'A'
-                    events = PlayaEvent.objects.get_and_cache(**kw)
+                    events = PlayaEvent.objects.get_and_cache(fields=fields, **kw)
 
             return events
         else:
-            return PlayaEvent.objects.get_and_cache(moderation='A', list_online=True)
+            return PlayaEvent.objects.get_and_cache(fields=requested_fields(request, self.fields),
+                                                    moderation='A', list_online=True)
 
 
 class AnonymousPlayaEventHandler(BasePlayaEventHandler, AnonymousBaseHandler):
     fields = event_fields
-    allow_methods = ('GET',)
+    allowed_methods = ('GET',)
 
     def read(self, request, year_year=None, playa_event_id=None):
         log.debug('AnonymousPlayaEventHandler GET')
@@ -241,12 +430,12 @@ class AnonymousPlayaEventHandler(BasePlayaEventHandler, AnonymousBaseHandler):
 
 class PlayaEventHandler(BasePlayaEventHandler, BaseHandler):
     fields = event_full_fields
-    allow_methods = ('GET', 'DELETE', 'PUT', 'POST')
+    allowed_methods = ('GET', 'DELETE', 'PUT', 'POST')
     anonymous = AnonymousPlayaEventHandler
 
     def _create_or_update(self, request, year_year=None, playa_event_id=None):
         user = request.user
-        if not user.get_profile().api_allowed:
+        if not api_allowed(request):
             return rc_response(request, rc.BAD_REQUEST, 'User not permitted to use the API')
 
         method = request.method
@@ -279,73 +468,13 @@ class PlayaEventHandler(BasePlayaEventHandler, BaseHandler):
             if 'year' in data:
                 del data['year']
 
-        else:
-            log.debug('creating new event')
-            obj = PlayaEvent()
-            obj.creator = user
-            if not 'event_type' in data:
-                event_type = EventType.objects.get(pk=1)
-            else:
-                try:
-                    event_type = EventType.objects.get(abbr=data['event_type'])
-                except EventType.DoesNotExist:
-                    return rc_response(request, rc.NOT_HERE, 'No such EventType: %s' % data['event_type'])
-
-            obj.event_type = event_type
-
-        # get rid of illegal-to-update attributes
-        for key in ('id','pk'):
-            if key in data:
-                del data[key]
-
-        # now loop through the data, updating as needed
-        if 'year' in data:
-            try:
-                year = Year.objects.get(year=data['year'])
-            except Year.DoesNotExist:
-                return rc_response(request, rc.NOT_HERE, 'No such year: %s' % data['year'])
-
-            obj.year = year
-
-        # text fields
-        for key in ('print_description', 'url', 'contact_email', 'other_location', 'slug'):
-            if key in data:
-                val = data[key]
-                log.debug('setting %s=%s', key, val)
-                setattr(obj, key, val)
-
-        # moderation
-        if 'moderation' in data:
-            modkey = data['moderation'].upper()
-            if modkey in ('U','A','R'):
-                log.debug('setting moderation=%s', modkey)
-                obj.moderation = modkey
-
-        if 'hosted_by_camp' in data:
-            key = data['hosted_by_camp']
-            try:
-                camp = ThemeCamp.objects.get(pk=key)
-                log.debug('located at camp: %s', camp)
-                obj.hosted_by_camp = camp
-            except ThemeCamp.DoesNotExist:
-                return rc_response(request, rc.NOT_HERE, 'No such camp: %s' % key)
-
-        if 'located_at_art' in data:
-            key = data['located_at_art']
-            try:
-                art = ArtInstallation.objects.get(pk=key)
-                log.debug('located at art: %s', art)
-                obj.located_at_art = art
-            except ArtInstallation.DoesNotExist:
-                return rc_response(request, rc.NOT_HERE, 'No such art: %s' % key)
-
-        # booleans
-        for key in ('check_location', 'all_day', 'list_online', 'list_contact_online'):
-            if key in data:
-                val = data[key].upper()
-                val = val in ('1', 'T', 'Y', 'YES', 'TRUE', 'ON')
-                log.debug('setting %s=%s', key, val)
-                setattr(obj, key, val)
+        lookups = QueryLookups()
+        try:
+            if not playa_event_id:
+                obj = _new_event(user, data, lookups)
+            _apply_event(obj, data, lookups)
+        except LookupFailed, e:
+            return rc_response(request, rc.NOT_HERE, unicode(e))
 
         obj.save()
 
@@ -367,8 +496,7 @@ class PlayaEventHandler(BasePlayaEventHandler, BaseHandler):
 
     def delete(self, request, year_year=None, playa_event_id=None):
         log.debug('PlayaEventHandler DELETE: %s %s', year_year, playa_event_id)
-        user = request.user
-        if not user.get_profile().api_allowed:
+        if not api_allowed(request):
             return rc_response(request, rc.BAD_REQUEST, 'User not permitted to use the API')
 
         if (playa_event_id):
@@ -394,11 +522,80 @@ class PlayaEventHandler(BasePlayaEventHandler, BaseHandler):
         return self._create_or_update(request, year_year=year_year, playa_event_id=playa_event_id)
 
 
-class AnonymousThemeCampHandler(AnonymousBaseHandler):
+def _happening_at(request):
+    """The time asked for with ?at=, else now to the minute, and whether it was asked for.
+
+    Raises ValueError for a bad time.
+    """
+    if not hasattr(request, '_happening_at'):
+        value = request.GET.get('at')
+        if value:
+            try:
+                when = Occurrence._meta.get_field('start_time').to_python(value)
+            except ValidationError:
+                raise ValueError('Invalid at: %s' % value)
+        else:
+            when = datetime.now().replace(second=0, microsecond=0)
+        request._happening_at = (when, bool(value))
+    return request._happening_at
+
+class BaseHappeningHandler(object):
+    """
+    The events going on at ?at= (default now) and those starting
+    within the next ?within= minutes (default an hour), from the
+    year's interval index, see `playaevents.schedule`.
+    """
+    fields = event_fields
+
+    def change_marker(self, request, year_year=None):
+        if not cache_enabled():
+            return None
+
+        pk = year_id(year_year)
+        if pk is None:
+            return None
+
+        marker = year_generation(pk)
+        try:
+            when, asked = _happening_at(request)
+        except ValueError:
+            return None
+        if not asked:
+            # "now" moves on every minute
+            marker = max(marker, int(time.mktime(when.timetuple())) * 1000)
+        return marker
+
+    def read(self, request, year_year=None):
+        try:
+            year = Year.objects.get(year=year_year)
+        except Year.DoesNotExist:
+            return rc_response(request, rc.NOT_HERE, 'Year not found #%s' % year_year)
+
+        try:
+            when, asked = _happening_at(request)
+            within = int(request.GET.get('within', NEXT_WITHIN))
+        except ValueError, e:
+            return rc_response(request, rc.BAD_REQUEST, unicode(e))
+        if not 0 <= within <= HAPPENING_MAX_WITHIN:
+            return rc_response(request, rc.BAD_REQUEST,
+                               'within must be 0 to %i minutes' % HAPPENING_MAX_WITHIN)
+
+        now, next = happening(year, when, timedelta(minutes=within))
+        return {'at' : when, 'now' : now, 'next' : next}
+
+class AnonymousHappeningHandler(BaseHappeningHandler, AnonymousBaseHandler):
+    allowed_methods = ('GET',)
+
+class HappeningHandler(BaseHappeningHandler, BaseHandler):
+    allowed_methods = ('GET',)
+    anonymous = AnonymousHappeningHandler
+
+
+class AnonymousThemeCampHandler(YearChangeMarker, AnonymousBaseHandler):
     model = ThemeCamp
     fields = camp_fields
 
-    allow_methods = ('GET',)
+    allowed_methods = ('GET',)
 
     def read(self, request, year_year=None, camp_id=None):
         if(year_year):
@@ -407,25 +604,34 @@ class AnonymousThemeCampHandler(AnonymousBaseHandler):
             except Year.DoesNotExist:
                 return rc_response(request, rc.NOT_HERE, 'Year not found #%s' % year_year)
 
+            fields = requested_fields(request, self.fields)
+            build = sparse_records(camp_records, fields)
+
             if(camp_id):
-                camp = ThemeCamp.objects.filter(year=year,id=camp_id,list_online=True)
+                camp = build(ThemeCamp.objects.filter(year=year,id=camp_id,list_online=True))
+            elif 'since' in request.GET:
+                camp = changed_since(request, ThemeCamp.all_objects.filter(year=year),
+                                     Q(list_online=True) & ~Q(deleted=True), build)
+            elif is_paged(request):
+                camp = paginate(request, ThemeCamp.objects.filter(year=year), build)
             else:
-                camp = ThemeCamp.objects.get_and_cache(year=year,list_online=True)
+                camp = ThemeCamp.objects.get_and_cache(fields=fields, year=year, list_online=True)
             return camp
         else:
-            return ThemeCamp.objects.get_and_cache(list_online=True)
+            return ThemeCamp.objects.get_and_cache(fields=requested_fields(request, self.fields),
+                                                   list_online=True)
 
 
-class ThemeCampHandler(BaseHandler):
+class ThemeCampHandler(YearChangeMarker, BaseHandler):
     model = ThemeCamp
     fields = camp_full_fields
 
-    allow_methods = ('GET', 'DELETE', 'PUT', 'POST')
+    allowed_methods = ('GET', 'DELETE', 'PUT', 'POST')
     anonymous = AnonymousThemeCampHandler
 
     def _create_or_update(self, request, year_year=None, camp_id=None):
         user = request.user
-        if not user.get_profile().api_allowed:
+        if not api_allowed(request):
             return rc_response(request, rc.BAD_REQUEST, 'User not permitted to use the API')
 
         method = request.method
@@ -472,65 +678,10 @@ class ThemeCampHandler(BaseHandler):
             obj = ThemeCamp()
             obj.creator = user
 
-        # get rid of illegal-to-update attributes
-        for key in ('id','pk','deleted'):
-            if key in data:
-                del data[key]
-
-        # now loop through the data, updating as needed
-        if 'year' in data:
-            try:
-                year = Year.objects.get(year=data['year'])
-            except Year.DoesNotExist:
-                return rc_response(request, rc.NOT_HERE, 'No such year: %s' % data['year'])
-
-            obj.year = year
-
-        if 'circular_street' in data:
-            key = data['circular_street']
-            try:
-                street = CircularStreet.objects.get(pk=key)
-                obj.circular_street = street
-            except CircularStreet.DoesNotExist:
-                return rc_response(request, rc.NOT_HERE, 'No such CircularStreet: %s' % key)
-        elif 'circular_street_name' in data:
-            key = data['circular_street_name']
-            try:
-                street = CircularStreet.objects.get(name__istartswith=key[0:2], year=obj.year)
-                obj.circular_street = street
-            except CircularStreet.DoesNotExist:
-                return rc_response(request, rc.NOT_HERE, 'No such CircularStreet: %s' % key)
-
-
-        if 'time_street' in data:
-            key = data['time_street']
-            try:
-                street = TimeStreet.objects.get(pk=key)
-                obj.time_address = street.name
-            except TimeStreet.DoesNotExist:
-                obj.time_address = data['time_address']
-        elif 'time_street_name' in data:
-            key = data['time_street_name']
-            try:
-                street = TimeStreet.objects.get(name=key, year=obj.year)
-                obj.time_address = street.name
-            except TimeStreet.DoesNotExist:
-                obj.time_address = data['time_street_name']
-
-        # text fields
-        for key in ('name','description', 'url', 'hometown', 'location_string', 'slug'):
-            if key in data:
-                val = data[key]
-                log.debug('setting %s=%s', key, val)
-                setattr(obj, key, val)
-
-        # booleans
-        for key in ('list_online',):
-            if key in data:
-                val = data[key].upper()
-                val = val in ('1', 'T', 'Y', 'YES', 'TRUE', 'ON')
-                log.debug('setting %s=%s', key, val)
-                setattr(obj, key, val)
+        try:
+            _apply_camp(obj, data, QueryLookups())
+        except LookupFailed, e:
+            return rc_response(request, rc.NOT_HERE, unicode(e))
 
         obj.save()
 
@@ -550,18 +701,23 @@ class ThemeCampHandler(BaseHandler):
             except Year.DoesNotExist:
                 return rc_response(request, rc.NOT_HERE, 'Year not found #%s' % year_year)
 
+            fields = requested_fields(request, self.fields)
+            build = sparse_records(camp_records, fields)
+
             if(camp_id):
-                camp = ThemeCamp.all_objects.filter(year=year,id=camp_id)
+                camp = build(ThemeCamp.all_objects.filter(year=year,id=camp_id))
+            elif 'since' in request.GET:
+                camp = changed_since(request, ThemeCamp.all_objects.filter(year=year),
+                                     ~Q(deleted=True), build)
             else:
-                camp = ThemeCamp.all_objects.get_and_cache(year=year)
+                camp = ThemeCamp.all_objects.get_and_cache(fields=fields, year=year)
             return camp
         else:
-            return ThemeCamp.all_objects.get_and_cache()
+            return ThemeCamp.all_objects.get_and_cache(fields=requested_fields(request, self.fields))
 
     def delete(self, request, year_year=None, camp_id=None):
         log.debug('ThemeCampHandler DELETE: %s %s', year_year, camp_id)
-        user = request.user
-        if not user.get_profile().api_allowed:
+        if not api_allowed(request):
             return rc_response(request, rc.BAD_REQUEST, 'User not permitted to use the API')
 
         if (camp_id):
@@ -587,66 +743,224 @@ class ThemeCampHandler(BaseHandler):
         return self._create_or_update(request, year_year=year_year, camp_id=camp_id)
 
 
-class AnonymousCircularStreetHandler(AnonymousBaseHandler):
-    allow_methods = ('GET',)
+class BulkHandler(BaseHandler):
+    """
+    Creates or updates a batch of objects in one request.
+
+    The body is a JSON list of objects with the same keys as the single
+    POST/PUT takes.  A row with an 'id' updates that object, one with a
+    known 'bm_fm_id' updates the object imported with it, where the model
+    has one, any other row creates a new object.
+
+    Everything the rows refer to is loaded up front with a few queries, all
+    rows are saved in one transaction, and the year's cached lists are
+    invalidated once at the end.  The response has a result per row, in
+    order: {'index', 'pk', 'created'}, or {'index', 'error'} for a row which
+    refers to something which isn't there.  Those rows are skipped, the
+    others are saved.  A database error rolls back the whole batch.
+
+    Subclasses name the `target` model, and the `apply_row(obj, row,
+    lookups)` function setting a row's fields on an object.
+    """
+    allowed_methods = ('POST',)
+    target = None
+    apply_row = None
+    match_bm_fm_id = False
+
+    def __init__(self):
+        if self.target is None or self.apply_row is None:
+            raise ImproperlyConfigured('%s needs a target model and an apply_row function'
+                                       % self.__class__.__name__)
+        super(BulkHandler, self).__init__()
+
+    def load(self, rows, objects, lookups):
+        """Load what `rows`, updating `objects`, refer to into `lookups`."""
+        lookups.load_years(row['year'] for row in rows if 'year' in row)
+
+    def new_object(self, user, row, lookups):
+        return self.target()
+
+    def create(self, request, year_year=None):
+        user = request.user
+        if not api_allowed(request):
+            return rc_response(request, rc.BAD_REQUEST, 'User not permitted to use the API')
+
+        try:
+            rows = json.loads(request.raw_post_data)
+        except ValueError:
+            return rc_response(request, rc.BAD_REQUEST, 'Body is not valid JSON')
+
+        if not (isinstance(rows, list) and all(isinstance(row, dict) for row in rows)):
+            return rc_response(request, rc.BAD_REQUEST, 'Expected a list of objects')
+
+        if len(rows) > BULK_MAX_ROWS:
+            return rc_response(request, rc.BAD_REQUEST, 'At most %i rows per request' % BULK_MAX_ROWS)
+
+        log.debug('%s: %i rows', self.__class__.__name__, len(rows))
+
+        if year_year:
+            for row in rows:
+                row.setdefault('year', year_year)
+
+        manager = self.target._default_manager
+        existing = manager.in_bulk(filter(None, [to_pk(row.get('id')) for row in rows]))
+
+        by_bm_fm_id = {}
+        if self.match_bm_fm_id:
+            bm_fm_ids = []
+            for row in rows:
+                try:
+                    bm_fm_ids.append(int(row['bm_fm_id']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            if bm_fm_ids:
+                for obj in manager.filter(bm_fm_id__in=bm_fm_ids):
+                    by_bm_fm_id[obj.bm_fm_id] = obj
+
+        lookups = BulkLookups()
+        self.load(rows, existing.values() + by_bm_fm_id.values(), lookups)
+
+        results = []
+        try:
+            with deferred_invalidation():
+                with transaction.commit_on_success():
+                    for index, row in enumerate(rows):
+                        results.append(self._save_row(user, index, row, existing, by_bm_fm_id, lookups))
+        except DatabaseError, e:
+            log.warn('%s: batch rolled back at row %i: %s', self.__class__.__name__, len(results), e)
+            return rc_response(request, rc.BAD_REQUEST,
+                               'Row %i could not be saved, nothing was: %s' % (len(results), e))
+
+        response = rc.ALL_OK
+        response.content = json.dumps({'results' : results})
+        return response
+
+    def _save_row(self, user, index, row, existing, by_bm_fm_id, lookups):
+        obj = None
+        if 'id' in row:
+            obj = existing.get(to_pk(row['id']))
+            if obj is None:
+                return {'index' : index, 'error' : 'Not found #%s' % row['id']}
+
+            # no updating the year!
+            row.pop('year', None)
+
+        elif self.match_bm_fm_id and 'bm_fm_id' in row:
+            try:
+                obj = by_bm_fm_id.get(int(row['bm_fm_id']))
+            except (TypeError, ValueError):
+                pass
+
+        try:
+            created = obj is None
+            if created:
+                obj = self.new_object(user, row, lookups)
+            self.apply_row(obj, row, lookups)
+        except LookupFailed, e:
+            return {'index' : index, 'error' : unicode(e)}
+
+        obj.save()
+        if self.match_bm_fm_id and obj.bm_fm_id is not None:
+            # a later row with the same bm_fm_id updates this one
+            by_bm_fm_id[obj.bm_fm_id] = obj
+
+        return {'index' : index, 'pk' : obj.id, 'created' : created}
+
+class ArtInstallationBulkHandler(BulkHandler):
+    target = ArtInstallation
+    apply_row = staticmethod(_apply_art)
+    match_bm_fm_id = True
+
+class PlayaEventBulkHandler(BulkHandler):
+    target = PlayaEvent
+    apply_row = staticmethod(_apply_event)
+
+    def load(self, rows, objects, lookups):
+        super(PlayaEventBulkHandler, self).load(rows, objects, lookups)
+        lookups.load_event_types()
+        lookups.load_camps(row['hosted_by_camp'] for row in rows if 'hosted_by_camp' in row)
+        lookups.load_art(row['located_at_art'] for row in rows if 'located_at_art' in row)
+
+    def new_object(self, user, row, lookups):
+        return _new_event(user, row, lookups)
+
+class ThemeCampBulkHandler(BulkHandler):
+    target = ThemeCamp
+    apply_row = staticmethod(_apply_camp)
+    match_bm_fm_id = True
+
+    def load(self, rows, objects, lookups):
+        super(ThemeCampBulkHandler, self).load(rows, objects, lookups)
+        lookups.load_streets(set(lookups.year_ids()) | set(obj.year_id for obj in objects))
+
+    def new_object(self, user, row, lookups):
+        obj = ThemeCamp()
+        obj.creator = user
+        return obj
+
+
+class BaseCircularStreetHandler(YearChangeMarker):
     model = CircularStreet
     fields = cstreet_fields
+
     def read(self, request, year_year=None):
-        base = CircularStreet.objects.filter()
+        base = CircularStreet.objects.select_related('year')
+        base = sparse_queryset(base, requested_fields(request, self.fields))
         if(year_year):
             try:
                 year = Year.objects.get(year=year_year)
             except Year.DoesNotExist:
                 return rc_response(request, rc.NOT_HERE, 'Year not found #%s' % year_year)
 
-            cstreet = CircularStreet.objects.filter(year=year)
+            cstreet = base.filter(year=year)
             return cstreet
         else:
             return base.all()
 
+class AnonymousCircularStreetHandler(BaseCircularStreetHandler, AnonymousBaseHandler):
+    allowed_methods = ('GET',)
 
-class CircularStreetHandler(BaseHandler):
-    allow_methods = ('GET',)
-    model = CircularStreet
-    fields = cstreet_fields
+class CircularStreetHandler(BaseCircularStreetHandler, BaseHandler):
+    allowed_methods = ('GET',)
     anonymous = AnonymousCircularStreetHandler
 
-class AnonymousTimeStreetHandler(AnonymousBaseHandler):
-    allow_methods = ('GET',)
+class BaseTimeStreetHandler(YearChangeMarker):
     model = TimeStreet
     fields = tstreet_fields
+
     def read(self, request, year_year=None):
-        base = TimeStreet.objects.filter()
+        base = TimeStreet.objects.select_related('year')
+        base = sparse_queryset(base, requested_fields(request, self.fields))
         if(year_year):
             try:
                 year = Year.objects.get(year=year_year)
             except Year.DoesNotExist:
                 return rc_response(request, rc.NOT_HERE, 'Year not found #%s' % year_year)
 
-            tstreet = TimeStreet.objects.filter(year=year)
+            tstreet = base.filter(year=year)
             return tstreet
         else:
             return base.all()
 
+class AnonymousTimeStreetHandler(BaseTimeStreetHandler, AnonymousBaseHandler):
+    allowed_methods = ('GET',)
 
-class TimeStreetHandler(BaseHandler):
-    allow_methods = ('GET',)
-    model = TimeStreet
-    fields = tstreet_fields
+class TimeStreetHandler(BaseTimeStreetHandler, BaseHandler):
+    allowed_methods = ('GET',)
     anonymous = AnonymousTimeStreetHandler
 
-class AnonymousYearHandler(AnonymousBaseHandler):
-    allow_methods = ('GET',)
+class AnonymousYearHandler(YearChangeMarker, AnonymousBaseHandler):
+    allowed_methods = ('GET',)
     model = Year
     fields = year_fields
 
-class YearHandler(BaseHandler):
-    allow_methods = ('GET',)
+class YearHandler(YearChangeMarker, BaseHandler):
+    allowed_methods = ('GET',)
     model = Year
     fields = year_fields
     anonymous = AnonymousYearHandler
 
 class UserHandler(BaseHandler):
-    allow_methods = ('GET',)
+    allowed_methods = ('GET',)
     model = User
     fields = user_fields
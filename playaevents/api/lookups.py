@@ -0,0 +1,172 @@
+"""
+The lookups the create/update handlers make while applying a row of data.
+
+`QueryLookups` makes one query per lookup, which is all a single POST or PUT
+needs.  `BulkLookups` answers the same lookups for a whole batch of rows from
+a handful of `__in` queries made up front, see the bulk handlers.
+"""
+from playaevents.models import Year, CircularStreet, TimeStreet, ThemeCamp, ArtInstallation
+from swingtime.models import EventType
+
+class LookupFailed(Exception):
+    """A row refers to something which isn't there, the message says what."""
+
+def to_pk(key):
+    """`key` as an integer pk, or None."""
+    try:
+        return int(key)
+    except (TypeError, ValueError):
+        return None
+
+class QueryLookups(object):
+
+    def year(self, year):
+        try:
+            return Year.objects.get(year=year)
+        except Year.DoesNotExist:
+            raise LookupFailed('No such year: %s' % year)
+
+    def default_event_type(self):
+        return EventType.objects.get(pk=1)
+
+    def event_type(self, abbr):
+        try:
+            return EventType.objects.get(abbr=abbr)
+        except EventType.DoesNotExist:
+            raise LookupFailed('No such EventType: %s' % abbr)
+
+    def camp(self, pk):
+        try:
+            return ThemeCamp.objects.get(pk=pk)
+        except ThemeCamp.DoesNotExist:
+            raise LookupFailed('No such camp: %s' % pk)
+
+    def art(self, pk):
+        try:
+            return ArtInstallation.objects.get(pk=pk)
+        except ArtInstallation.DoesNotExist:
+            raise LookupFailed('No such art: %s' % pk)
+
+    def circular_street(self, pk):
+        try:
+            return CircularStreet.objects.get(pk=pk)
+        except CircularStreet.DoesNotExist:
+            raise LookupFailed('No such CircularStreet: %s' % pk)
+
+    def circular_street_named(self, name, year_id):
+        """The street of year `year_id` whose name starts like `name`."""
+        try:
+            return CircularStreet.objects.get(name__istartswith=name[0:2], year=year_id)
+        except CircularStreet.DoesNotExist:
+            raise LookupFailed('No such CircularStreet: %s' % name)
+
+    def time_street(self, pk):
+        """The TimeStreet `pk`, or None."""
+        try:
+            return TimeStreet.objects.get(pk=pk)
+        except TimeStreet.DoesNotExist:
+            return None
+
+    def time_street_named(self, name, year_id):
+        """The TimeStreet of year `year_id` called `name`, or None."""
+        try:
+            return TimeStreet.objects.get(name=name, year=year_id)
+        except TimeStreet.DoesNotExist:
+            return None
+
+class BulkLookups(QueryLookups):
+    """
+    Lookups answered from memory.  Call the `load_` methods with every key
+    the batch refers to first, each is one query.
+    """
+    def __init__(self):
+        self._years = {}
+        self._event_types = None
+        self._camps = {}
+        self._art = {}
+        self._circular_streets = {}
+        self._time_streets = {}
+
+    def load_years(self, names):
+        self._years = dict((y.year, y) for y in Year.objects.filter(year__in=set(names)))
+
+    def year_ids(self):
+        """The pks of the loaded years."""
+        return [y.pk for y in self._years.itervalues()]
+
+    def load_event_types(self):
+        self._event_types = list(EventType.objects.all())
+
+    def load_camps(self, pks):
+        self._camps = ThemeCamp.objects.in_bulk(filter(None, map(to_pk, set(pks))))
+
+    def load_art(self, pks):
+        self._art = ArtInstallation.objects.in_bulk(filter(None, map(to_pk, set(pks))))
+
+    def load_streets(self, year_ids):
+        year_ids = set(year_ids)
+        self._circular_streets = dict((s.pk, s) for s in CircularStreet.objects.filter(year__in=year_ids))
+        self._time_streets = dict((s.pk, s) for s in TimeStreet.objects.filter(year__in=year_ids))
+
+    def year(self, year):
+        try:
+            return self._years[unicode(year)]
+        except KeyError:
+            raise LookupFailed('No such year: %s' % year)
+
+    def default_event_type(self):
+        for event_type in self._event_types:
+            if event_type.pk == 1:
+                return event_type
+        raise EventType.DoesNotExist
+
+    def event_type(self, abbr):
+        for event_type in self._event_types:
+            if event_type.abbr == abbr:
+                return event_type
+        raise LookupFailed('No such EventType: %s' % abbr)
+
+    def camp(self, pk):
+        try:
+            return self._camps[to_pk(pk)]
+        except KeyError:
+            raise LookupFailed('No such camp: %s' % pk)
+
+    def art(self, pk):
+        try:
+            return self._art[to_pk(pk)]
+        except KeyError:
+            raise LookupFailed('No such art: %s' % pk)
+
+    def circular_street(self, pk):
+        if to_pk(pk) is None:
+            raise LookupFailed('No such CircularStreet: %s' % pk)
+        # streets are only loaded for the batch's years
+        street = self._circular_streets.get(to_pk(pk))
+        if street is None:
+            return super(BulkLookups, self).circular_street(pk)
+        return street
+
+    def circular_street_named(self, name, year_id):
+        prefix = name[0:2].lower()
+        found = [s for s in self._circular_streets.itervalues()
+                 if s.year_id == year_id and s.name.lower().startswith(prefix)]
+        if not found:
+            raise LookupFailed('No such CircularStreet: %s' % name)
+        if len(found) > 1:
+            raise LookupFailed('More than one CircularStreet starts like %s' % name)
+        return found[0]
+
+    def time_street(self, pk):
+        if to_pk(pk) is None:
+            return None
+        street = self._time_streets.get(to_pk(pk))
+        if street is None:
+            return super(BulkLookups, self).time_street(pk)
+        return street
+
+    def time_street_named(self, name, year_id):
+        for street in self._time_streets.itervalues():
+            if street.year_id == year_id and street.name == name:
+                return street
+        return None
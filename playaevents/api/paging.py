@@ -0,0 +1,50 @@
+"""
+Keyset pagination for the API lists, `?limit=<n>&cursor=<cursor>`.
+
+A paged list answers with
+
+    {'results' : [<up to limit rows, by id>],
+     'next' : <cursor of the next page, or null on the last one>}
+
+Pages are picked with `id > <last id of the previous page>` rather than an
+OFFSET, so every page costs the same index range scan, and rows added or
+removed while a client pages through don't shift the pages after them.
+"""
+from django.conf import settings
+from django.utils.http import base36_to_int, int_to_base36
+from piston.utils import rc
+from playaevents.api.utils import rc_response
+
+PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 100)
+MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+
+def is_paged(request):
+    return 'limit' in request.GET or 'cursor' in request.GET
+
+def paginate(request, queryset, build=list):
+    """Return the page of `queryset` asked for by `request`.
+
+    `build` turns the queryset of the page's rows into what the emitter is
+    given, e.g. `event_records`.
+    """
+    try:
+        limit = int(request.GET.get('limit') or PAGE_SIZE)
+        cursor = request.GET.get('cursor')
+        after = cursor and base36_to_int(cursor) or 0
+    except ValueError:
+        return rc_response(request, rc.BAD_REQUEST, 'Invalid limit or cursor')
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # one more than asked for, to know if there is a next page
+    rows = build(queryset.filter(id__gt=after).order_by('id')[:limit + 1])
+
+    next = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next = int_to_base36(rows[-1].id)
+
+    return {
+        'results' : rows,
+        'next' : next,
+        }
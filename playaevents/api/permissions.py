@@ -0,0 +1,32 @@
+"""
+Who may write through the API.
+
+The decision is the `api_allowed` flag of the user's profile.  It is worked
+out once per request, and with the bmprofile profile (see
+`BmProfileManager.api_allowed`) kept in the cache until the profile changes,
+so writes normally don't query for it at all.
+"""
+from django.conf import settings
+from django.db.models import get_model
+
+def _profile_manager():
+    module = getattr(settings, 'AUTH_PROFILE_MODULE', None)
+    if not module:
+        return None
+    model = get_model(*module.split('.'))
+    return getattr(model, '_default_manager', None)
+
+def user_api_allowed(user):
+    """Whether `user` may write through the API."""
+    manager = _profile_manager()
+    if hasattr(manager, 'api_allowed'):
+        return manager.api_allowed(user)
+    return bool(user.get_profile().api_allowed)
+
+def api_allowed(request):
+    """Whether `request.user` may write through the API, decided once per request."""
+    try:
+        return request.api_allowed
+    except AttributeError:
+        allowed = request.api_allowed = user_api_allowed(request.user)
+        return allowed
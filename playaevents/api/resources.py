@@ -0,0 +1,142 @@
+"""
+Conditional GET for the API.
+
+Handlers with a `change_marker(request, *args, **kwargs)` method return a
+number which goes up whenever their output may change, the cache generation
+of the year they read from (see `playaevents.caching`).  `ConditionalResource`
+turns it into an ETag and a Last-Modified header, and answers a request whose
+If-None-Match or If-Modified-Since is still current with a 304, before the
+handler runs.
+"""
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.hashcompat import md5_constructor
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from piston.emitters import Emitter
+from piston.resource import CHALLENGE
+from playaevents.api.throttle import ThrottledResource
+
+def accepted_format(accept):
+    """The name of the emitter the Accept header `accept` prefers, or None.
+
+    Only exact media types count, anything else gets the default format.
+    """
+    ranges = []
+    for n, media_range in enumerate(accept.split(',')):
+        params = media_range.split(';')
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        # the highest quality first, in the order given among equals
+        ranges.append((-quality, n, params[0].strip().lower()))
+
+    by_type = {}
+    # sorted, so 'json' has text/javascript rather than 'jsonstream'
+    for name, (emitter, ct) in sorted(Emitter.EMITTERS.items()):
+        by_type.setdefault(ct.split(';')[0].strip().lower(), name)
+    for quality, n, media_type in sorted(ranges):
+        if quality < 0 and media_type in by_type:
+            return by_type[media_type]
+    return None
+
+class ConditionalResource(ThrottledResource):
+    """
+    A piston `Resource` which sends validators with GETs, and
+    honours them, for handlers with a `change_marker`.
+    """
+    def determine_emitter(self, request, *args, **kwargs):
+        """
+        The format asked for with the url or ?format=,
+        else by the Accept header, else JSON.
+        """
+        if kwargs.get('emitter_format') or 'format' in request.GET:
+            return super(ConditionalResource, self).determine_emitter(request, *args, **kwargs)
+        return accepted_format(request.META.get('HTTP_ACCEPT', '')) or 'json'
+
+    def validators(self, handler, request, *args, **kwargs):
+        """
+        Returns (etag, last modified) for what `handler` would
+        answer to `request`, or None when it can't tell.
+        """
+        change_marker = getattr(handler, 'change_marker', None)
+        if change_marker is None:
+            return None
+
+        marker = change_marker(request, *args, **kwargs)
+        if marker is None:
+            return None
+
+        # the anonymous and authenticated handlers show different fields,
+        # the path and query string pick the rows, the format may come
+        # from the Accept header
+        etag = md5_constructor('%s:%s:%s:%s' % (
+            handler.__class__.__name__, marker,
+            self.determine_emitter(request, *args, **kwargs),
+            request.get_full_path())).hexdigest()
+        # markers are in milliseconds, round up to the next whole second
+        return etag, int(marker / 1000) + 1
+
+    def not_modified(self, request, etag, last_modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            return if_none_match.strip() == '*' or etag in parse_etags(if_none_match)
+
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and if_modified_since >= last_modified
+
+    def authenticate(self, request, rm):
+        """
+        Authenticates once per request: `__call__` needs the
+        handler for the validators, and piston's `__call__`
+        asks again on its way to it.
+        """
+        done = getattr(request, '_api_authenticated', None)
+        if done is not None and done[0] == rm:
+            return done[1]
+        result = super(ConditionalResource, self).authenticate(request, rm)
+        request._api_authenticated = (rm, result)
+        return result
+
+    def fast_response(self, request, handler, anonymous, *args, **kwargs):
+        """
+        Hook for subclasses which can answer a GET without
+        running the handler, returns a response or None.
+        """
+        return None
+
+    def __call__(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return super(ConditionalResource, self).__call__(request, *args, **kwargs)
+
+        handler, anonymous = self.authenticate(request, 'GET')
+        validators = None
+        if anonymous is not CHALLENGE:
+            validators = self.validators(handler, request, *args, **kwargs)
+
+        if validators:
+            etag, last_modified = validators
+            # the emitter keeps what it renders under it
+            request.api_etag = etag
+            if self.not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+                response['ETag'] = 'W/"%s"' % etag
+                response['Last-Modified'] = http_date(last_modified)
+                return response
+
+        response = None
+        if anonymous is not CHALLENGE:
+            response = self.fast_response(request, handler, anonymous, *args, **kwargs)
+        if response is None:
+            response = super(ConditionalResource, self).__call__(request, *args, **kwargs)
+
+        if validators and response.status_code == 200:
+            # weak, the gzipped snapshots share them with the plain ones
+            response['ETag'] = 'W/"%s"' % etag
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Accept',))
+        return response
@@ -0,0 +1,167 @@
+"""
+Pre-rendered snapshots of the anonymous per-year lists.
+
+The anonymous event, camp, art, cstreet and tstreet lists for a year are the
+same bytes for every client, so they are rendered once to a file under
+API_SNAPSHOT_DIR, next to a gzipped copy, and `SnapshotResource` serves those
+files without going through the handler or the emitter.
+
+Snapshot files are named after the year's cache generation (see
+`playaevents.caching`), so any change to the year's data makes the old files
+unreachable.  The first request for the new generation renders them again,
+single-flight, or they can be built ahead with `manage.py build_snapshots`.
+"""
+import gzip
+import os
+import tempfile
+from cStringIO import StringIO
+from django.conf import settings
+from django.core.servers.basehttp import FileWrapper
+from django.http import HttpRequest, HttpResponse
+from keyedcache import cache_enabled, cache_key
+from piston.emitters import Emitter
+from piston.handler import typemapper
+from playaevents.api import handlers
+from playaevents.api.resources import ConditionalResource
+from playaevents.caching import acquire_lease, year_generation, year_id
+import logging
+
+log = logging.getLogger(__name__)
+
+# None turns snapshots off
+SNAPSHOT_DIR = getattr(settings, 'API_SNAPSHOT_DIR', None)
+
+RESOURCES = {
+    'event' : handlers.AnonymousPlayaEventHandler,
+    'camp' : handlers.AnonymousThemeCampHandler,
+    'art' : handlers.AnonymousArtInstallationHandler,
+    'cstreet' : handlers.AnonymousCircularStreetHandler,
+    'tstreet' : handlers.AnonymousTimeStreetHandler,
+    }
+
+def snapshot_path(resource, year_id, generation):
+    return os.path.join(SNAPSHOT_DIR, '%s-%s-%s.json' % (resource, year_id, generation))
+
+def _write(path, content):
+    """Write `content` to `path` atomically, so readers never see half a file."""
+    fd, tmp = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix='.tmp-')
+    try:
+        os.write(fd, content)
+    finally:
+        os.close(fd)
+    os.chmod(tmp, 0644)
+    os.rename(tmp, path)
+
+def _remove_old(resource, year_id, keep):
+    prefix = '%s-%s-' % (resource, year_id)
+    for name in os.listdir(SNAPSHOT_DIR):
+        path = os.path.join(SNAPSHOT_DIR, name)
+        if name.startswith(prefix) and not path.startswith(keep):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+def render(resource, year_year):
+    """Render the anonymous `resource` list for `year_year`, as the API would.
+
+    Returns the utf-8 content, or None when the handler answers
+    with an error response.
+    """
+    handler = RESOURCES[resource]()
+    request = HttpRequest()
+    request.method = 'GET'
+
+    result = handler.read(request, year_year=year_year)
+    if isinstance(result, HttpResponse):
+        return None
+
+    emitter, ct = Emitter.get('json')
+    content = emitter(result, typemapper, handler, handler.fields, True).render(request)
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return content
+
+def build_snapshot(resource, year_year):
+    """Write the current snapshot of `resource` for `year_year`, returning its path or None."""
+    pk = year_id(year_year)
+    if pk is None:
+        return None
+
+    if not os.path.isdir(SNAPSHOT_DIR):
+        os.makedirs(SNAPSHOT_DIR)
+
+    # read before rendering: a change while we render bumps the generation,
+    # and the next request renders again
+    path = snapshot_path(resource, pk, year_generation(pk))
+    content = render(resource, year_year)
+    if content is None:
+        return None
+
+    buf = StringIO()
+    gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9)
+    gz.write(content)
+    gz.close()
+
+    # the plain file last, its presence means both are there
+    _write(path + '.gz', buf.getvalue())
+    _write(path, content)
+
+    _remove_old(resource, pk, keep=path)
+    log.debug('built snapshot %s', path)
+    return path
+
+def serve_snapshot(request, resource, year_year):
+    """Return a response with the snapshot of `resource`, or None to let the handler answer."""
+    pk = year_id(year_year)
+    if pk is None:
+        return None
+
+    generation = year_generation(pk)
+    path = snapshot_path(resource, pk, generation)
+    if not os.path.exists(path):
+        lease = acquire_lease(cache_key('snapshot', resource, pk, generation))
+        if lease is None:
+            # someone else is rendering it
+            return None
+        try:
+            if not os.path.exists(path) and build_snapshot(resource, year_year) is None:
+                return None
+        finally:
+            lease.release()
+
+    encoding = None
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        path, encoding = path + '.gz', 'gzip'
+
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        # replaced by a newer generation since we looked
+        return None
+
+    ct = Emitter.get('json')[1]
+    response = HttpResponse(FileWrapper(f), content_type=ct)
+    response['Content-Length'] = str(os.fstat(f.fileno()).st_size)
+    response['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+class SnapshotResource(ConditionalResource):
+    """
+    A `ConditionalResource` which answers plain anonymous
+    GETs of a year's list from the snapshot of `snapshot`.
+    """
+    def __init__(self, handler, authentication=None, snapshot=None):
+        super(SnapshotResource, self).__init__(handler, authentication=authentication)
+        self.snapshot = snapshot
+
+    def fast_response(self, request, handler, anonymous, *args, **kwargs):
+        if (SNAPSHOT_DIR and self.snapshot and cache_enabled()
+            and anonymous is True and isinstance(handler, RESOURCES[self.snapshot])
+            and not request.GET and kwargs.keys() == ['year_year']
+            and self.determine_emitter(request, **kwargs) == 'json'):
+
+            return serve_snapshot(request, self.snapshot, kwargs['year_year'])
+        return None
@@ -0,0 +1,48 @@
+"""
+Sparse fieldsets for the API, `?fields=id,title,occurrence_set`.
+
+A request with `fields` gets only those of the handler's fields, and the id.
+Nested fields are sent whole, and names the handler doesn't send are
+ignored.  The handlers read only the columns those fields need, and skip
+queries for the ones which aren't asked for (see `playaevents.records`);
+the emitters write only those fields.
+"""
+from functools import partial
+
+def field_name(field):
+    if isinstance(field, (list, tuple)):
+        return field[0]
+    return field
+
+def requested_fields(request, fields):
+    """The names of the handler `fields` asked for, None when there is no ?fields=."""
+    value = request.GET.get('fields')
+    if not value:
+        return None
+
+    wanted = set(name.strip() for name in value.split(','))
+    wanted.add('id')
+    return frozenset(name for name in map(field_name, fields) if name in wanted)
+
+def narrow(fields, names):
+    """The field spec `fields` cut down to `names`."""
+    if names is None:
+        return fields
+    return tuple(field for field in fields if field_name(field) in names)
+
+def sparse_records(build, names):
+    """The records builder `build` (e.g. `event_records`) reading only `names`."""
+    if names is None:
+        return build
+    return partial(build, fields=names)
+
+def sparse_queryset(queryset, names):
+    """`queryset` loading only the columns of `names`, when they are all model fields."""
+    if names is None:
+        return queryset
+
+    meta = queryset.model._meta
+    if not names <= set(f.name for f in meta.fields):
+        # a method or property, which may read anything
+        return queryset
+    return queryset.only(meta.pk.name, *names)
@@ -0,0 +1,69 @@
+"""
+Incremental sync for the API lists, `?since=<token>`.
+
+Events, camps and art carry a `modified` timestamp.  A list requested with a
+`since` token answers with
+
+    {'token' : <token for the next sync>,
+     'changed' : [<rows changed since the token>],
+     'deleted' : [<ids of rows which dropped out of the list since>]}
+
+so a client only downloads what was edited.  Rejected and unlisted events and
+deleted camps stay in the database with a new `modified`, and come back as
+tombstones in 'deleted'.  An empty token (`?since=`) asks for everything, and
+a token to start syncing from.
+
+Tokens are opaque to clients.  Rows are looked up from API_SYNC_OVERLAP
+seconds before the token's time, so a row saved by a transaction which was
+still open when the previous token was made is not missed; clients should
+expect to see some rows again.
+"""
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils.http import base36_to_int, int_to_base36
+from piston.utils import rc
+from playaevents.api.utils import rc_response
+
+OVERLAP = timedelta(seconds=getattr(settings, 'API_SYNC_OVERLAP', 60))
+
+def make_token(when):
+    return int_to_base36(int(time.mktime(when.timetuple())) * 1000 + when.microsecond / 1000)
+
+def parse_token(token):
+    """The datetime of `token`, None for an empty one.  Raises ValueError for bad tokens."""
+    if not token:
+        return None
+    return datetime.fromtimestamp(base36_to_int(token) / 1000.0)
+
+def changed_since(request, base, visible=None, build=list):
+    """Answer the ?since= request for the rows of the queryset `base`.
+
+    `visible` is a Q object picking the rows the list shows, None when it
+    shows all of them, and `build` turns a queryset of those into what the
+    emitter is given.
+    """
+    try:
+        since = parse_token(request.GET.get('since'))
+    except (ValueError, OverflowError):
+        return rc_response(request, rc.BAD_REQUEST, 'Invalid since token')
+
+    # taken before the queries, anything saved while they run is picked
+    # up again by the next sync
+    token = make_token(datetime.now())
+
+    changed = base
+    if since is not None:
+        changed = base.filter(modified__gte=since - OVERLAP)
+
+    deleted = []
+    if visible is not None:
+        if since is not None:
+            deleted = list(changed.exclude(visible).values_list('id', flat=True))
+        changed = changed.filter(visible)
+
+    return {
+        'token' : token,
+        'changed' : build(changed),
+        'deleted' : deleted,
+        }
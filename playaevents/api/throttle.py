@@ -0,0 +1,155 @@
+"""
+Token bucket rate limiting of API writes.
+
+Every POST, PUT or DELETE by an authenticated API user takes a token from
+that user's bucket and from the bucket of the address it came from, when
+both have one.  The buckets refill at API_THROTTLE_USER_RATE and
+API_THROTTLE_IP_RATE tokens a second up to API_THROTTLE_USER_BURST and
+API_THROTTLE_IP_BURST, and a write finding either empty is answered 429 Too
+Many Requests, with a Retry-After of when there will be a token again.
+
+The buckets live in the cache backend, so all the workers sharing it see
+the same ones.  Taking a token is a get and a set, not atomic: writes racing
+each other may both take the last token, which lets a burst through a
+little larger than configured, never a sustained rate.
+"""
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.handlers import wsgi
+from django.http import HttpResponse
+from keyedcache import cache_key
+from piston.resource import Resource, CHALLENGE
+import keyedcache
+import logging
+
+log = logging.getLogger(__name__)
+
+WRITE_METHODS = ('POST', 'PUT', 'DELETE')
+
+# Django doesn't know this one yet
+wsgi.STATUS_CODE_TEXT.setdefault(429, 'TOO MANY REQUESTS')
+
+class TokenBucket(object):
+    """
+    Buckets of `burst` tokens refilling at `rate` a second, one per
+    identity, kept in the cache under `scope`.  A `rate` of 0 or None
+    turns them off.
+    """
+    def __init__(self, scope, rate, burst):
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+
+    def tokens(self, ident, now):
+        """The tokens in the bucket of `ident` at `now`."""
+        state = keyedcache.cache.get(cache_key('throttle', self.scope, ident))
+        if state is None:
+            return float(self.burst)
+        tokens, updated = state
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def wait(self, tokens):
+        """The seconds until a bucket holding `tokens` has one to give, 0 if it has one now."""
+        if tokens >= 1:
+            return 0
+        return (1 - tokens) / float(self.rate)
+
+    def store(self, ident, tokens, now):
+        # kept until it would be full again, a missing bucket is a full one
+        keyedcache.cache.set(cache_key('throttle', self.scope, ident), (tokens, now),
+                             int((self.burst - tokens) / float(self.rate)) + 1)
+
+    def take(self, ident, now=None):
+        """Take a token for `ident`, returning 0, or the seconds until there is one."""
+        if not self.rate:
+            return 0
+        if now is None:
+            now = time.time()
+
+        tokens = self.tokens(ident, now)
+        wait = self.wait(tokens)
+        if not wait:
+            self.store(ident, tokens - 1, now)
+        return wait
+
+class Throttle(object):
+    """
+    The per-user and per-address buckets, and per worker counts
+    of the writes let through and turned away; see the cache stats
+    view.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = dict((bucket.scope, 0) for bucket in buckets)
+
+    def wait(self, request):
+        """The seconds `request` has to wait, 0 if it may go ahead now.
+
+        Tokens are only taken when every bucket has one, a write turned
+        away by one bucket costs nothing from the others.  It is counted
+        against each bucket which would have turned it away.
+        """
+        now = time.time()
+        idents = {
+            'user' : request.user.pk,
+            'ip' : request.META.get('REMOTE_ADDR'),
+            }
+        levels = [(bucket, idents[bucket.scope], bucket.tokens(idents[bucket.scope], now))
+                  for bucket in self.buckets if bucket.rate]
+        waits = [(bucket.scope, bucket.wait(tokens)) for bucket, ident, tokens in levels]
+
+        wait = max([0] + [w for scope, w in waits])
+        if wait:
+            with self._lock:
+                for scope, w in waits:
+                    if w:
+                        self.throttled[scope] += 1
+            log.info('throttled %s %s of %s from %s for %.1fs', request.method,
+                     request.path, request.user, idents['ip'], wait)
+            return wait
+
+        for bucket, ident, tokens in levels:
+            bucket.store(ident, tokens - 1, now)
+        with self._lock:
+            self.allowed += 1
+        return 0
+
+    def stats(self):
+        with self._lock:
+            stats = {'allowed' : self.allowed}
+            for scope, count in self.throttled.items():
+                stats['throttled_%s' % scope] = count
+            return stats
+
+throttle = Throttle((
+    TokenBucket('user',
+                getattr(settings, 'API_THROTTLE_USER_RATE', 5),
+                getattr(settings, 'API_THROTTLE_USER_BURST', 60)),
+    TokenBucket('ip',
+                getattr(settings, 'API_THROTTLE_IP_RATE', 10),
+                getattr(settings, 'API_THROTTLE_IP_BURST', 120)),
+    ))
+
+def too_many_requests(wait):
+    response = HttpResponse('Too many requests, retry in %i seconds' % math.ceil(wait),
+                            status=429, mimetype='text/plain')
+    response['Retry-After'] = str(int(math.ceil(wait)))
+    return response
+
+class ThrottledResource(Resource):
+    """
+    A piston `Resource` which rate limits the writes of
+    authenticated users, see `throttle`.
+    """
+    def authenticate(self, request, rm):
+        handler, anonymous = super(ThrottledResource, self).authenticate(request, rm)
+        if rm in WRITE_METHODS and anonymous is False:
+            wait = throttle.wait(request)
+            if wait:
+                # piston answers a challenge with what the "handler" returns
+                return (lambda: too_many_requests(wait)), CHALLENGE
+        return handler, anonymous
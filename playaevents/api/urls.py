@@ -1,28 +1,39 @@
 from django.conf import settings
 from django.conf.urls.defaults import patterns, url
-from piston.resource import Resource
+from playaevents.api.resources import ConditionalResource
 from playaevents.api import handlers
 from signedauth.authentication import IPUserAuthentication
-from playaevents.api.views import apidocs
+from playaevents.api.snapshots import SnapshotResource
+from playaevents.api.throttle import ThrottledResource
+from playaevents.api.views import apidocs, bundle
 import logging
 
 log = logging.getLogger(__name__)
 
 auth = IPUserAuthentication()
 
-year_handler = Resource(handlers.YearHandler, authentication=auth)
-camp_handler = Resource(handlers.ThemeCampHandler, authentication=auth)
-art_handler = Resource(handlers.ArtInstallationHandler, authentication=auth)
-event_handler = Resource(handlers.PlayaEventHandler, authentication=auth)
-user_handler = Resource(handlers.UserHandler, authentication=auth)
-cstreet_handler = Resource(handlers.CircularStreetHandler, authentication=auth)
-tstreet_handler = Resource(handlers.TimeStreetHandler, authentication=auth)
+year_handler = ConditionalResource(handlers.YearHandler, authentication=auth)
+camp_handler = SnapshotResource(handlers.ThemeCampHandler, authentication=auth, snapshot='camp')
+art_handler = SnapshotResource(handlers.ArtInstallationHandler, authentication=auth, snapshot='art')
+event_handler = SnapshotResource(handlers.PlayaEventHandler, authentication=auth, snapshot='event')
+user_handler = ThrottledResource(handlers.UserHandler, authentication=auth)
+cstreet_handler = SnapshotResource(handlers.CircularStreetHandler, authentication=auth, snapshot='cstreet')
+tstreet_handler = SnapshotResource(handlers.TimeStreetHandler, authentication=auth, snapshot='tstreet')
+camp_bulk_handler = ThrottledResource(handlers.ThemeCampBulkHandler, authentication=auth)
+art_bulk_handler = ThrottledResource(handlers.ArtInstallationBulkHandler, authentication=auth)
+event_bulk_handler = ThrottledResource(handlers.PlayaEventBulkHandler, authentication=auth)
+happening_handler = ConditionalResource(handlers.HappeningHandler, authentication=auth)
 
 urlpatterns = patterns(
     '',
     url(r'^docs/', apidocs, name="apidocs"),
     url(r'^user/', user_handler),
     url(r'^year/', year_handler),
+    url(r'^(?P<year_year>\d{4})/bundle/$', bundle, name='api_bundle'),
+    url(r'^(?P<year_year>\d{4})/camp/bulk/$', camp_bulk_handler),
+    url(r'^(?P<year_year>\d{4})/art/bulk/$', art_bulk_handler),
+    url(r'^(?P<year_year>\d{4})/event/bulk/$', event_bulk_handler),
+    url(r'^(?P<year_year>\d{4})/event/happening/$', happening_handler),
     url(r'^(?P<year_year>\d{4})/camp/(?P<camp_id>\d+)/$', camp_handler),
     url(r'^(?P<year_year>\d{4})/camp/', camp_handler),
     url(r'^(?P<year_year>\d{4})/art/(?P<art_id>\d+)/$', art_handler),
@@ -35,7 +46,7 @@ urlpatterns = patterns(
 
 if settings.DEBUG:
     from signedauth.explore.handlers import EchoHandler
-    echo = Resource(handler=EchoHandler, authentication=auth)
+    echo = ThrottledResource(handler=EchoHandler, authentication=auth)
 
     urlpatterns += patterns(
         '',
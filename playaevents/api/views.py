@@ -1,8 +1,12 @@
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from playaevents.api.bundles import serve_bundle
 
 def apidocs(request):
     ctx = RequestContext(request, {
             'server' : request.get_host()
             })
     return render_to_response('playaevents/apidocs.html', ctx)
+
+def bundle(request, year_year):
+    return serve_bundle(request, year_year)
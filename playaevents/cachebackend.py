@@ -0,0 +1,286 @@
+"""
+Sharded, memory-mapped cache backend.
+
+    CACHES = {
+        'default' : {
+            'BACKEND' : 'playaevents.cachebackend.MmapShardCache',
+            'LOCATION' : '/path/to/cache',
+            'OPTIONS' : {'SHARDS' : 8, 'SHARD_SIZE' : 32*1024*1024, 'SLOTS' : 8192},
+            }
+        }
+
+Every key hashes to one of a fixed set of shard files, which are mapped into
+every worker on the node, so they all share one cache without a network
+service.  A shard is a header, a hash index of fixed-size slots and a data
+area used as a ring buffer: records are appended at the write head and are
+lost once the head comes round again.  A hit on a record which is about to be
+overwritten appends it again, which gives an approximate LRU without keeping
+a list, and slots also carry an expiry time.
+
+Writers hold an exclusive flock on the shard and readers a shared one; a
+hit takes the exclusive lock afterwards to record its access time.  Values
+are unpickled straight out of the mapping, without copying them.
+"""
+import cPickle as pickle
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from cStringIO import StringIO
+from django.core.cache.backends.base import BaseCache
+from django.utils.hashcompat import md5_constructor
+
+MAGIC = 'PESHARD1'
+# magic, number of slots, data area size, write position
+HEADER = struct.Struct('<8sIQQ')
+HEADER_SIZE = 64
+# key hash, write position of the record, record length, expires, last access
+SLOT = struct.Struct('<QQIII4x')
+# key hash, key length, value length
+RECORD = struct.Struct('<QII')
+# slots looked at for a key before evicting the least recently used of them
+PROBES = 8
+
+class Shard(object):
+    """One mapped shard file.
+
+    Write positions only ever grow, and a record's physical offset is its
+    position modulo the data area size, so a record written at position `p`
+    is still intact for as long as the write head is no further than
+    `p + data_size`.
+    """
+
+    def __init__(self, fname, size, slots):
+        self.slots = slots
+        self.data_start = HEADER_SIZE + slots * SLOT.size
+        self.data_size = size - self.data_start
+        if self.data_size <= 0:
+            raise ValueError('SHARD_SIZE too small for %i slots' % slots)
+
+        # threads share the process' flock, so they need a lock of their own
+        self._lock = threading.Lock()
+        self.fd = os.open(fname, os.O_RDWR | os.O_CREAT, 0644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size != size:
+                os.ftruncate(self.fd, size)
+                self.mm = mmap.mmap(self.fd, size)
+                self.format()
+            else:
+                self.mm = mmap.mmap(self.fd, size)
+                magic, nslots, data_size, pos = HEADER.unpack_from(self.mm, 0)
+                if (magic, nslots, data_size) != (MAGIC, slots, self.data_size):
+                    self.format()
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        with self._lock:
+            fcntl.flock(self.fd, exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def format(self):
+        """Empty the shard, the caller must hold the exclusive lock."""
+        self.mm[HEADER_SIZE:self.data_start] = '\0' * (self.data_start - HEADER_SIZE)
+        HEADER.pack_into(self.mm, 0, MAGIC, self.slots, self.data_size, 0)
+
+    def _position(self):
+        return HEADER.unpack_from(self.mm, 0)[3]
+
+    def _slot_offset(self, n):
+        return HEADER_SIZE + n * SLOT.size
+
+    def _probe(self, h):
+        base = (h & 0xffffffff) % self.slots
+        return [(base + i) % self.slots for i in range(PROBES)]
+
+    def _record_offset(self, pos):
+        return self.data_start + pos % self.data_size
+
+    def _valid(self, slot, now, head):
+        h, pos, length, expires, access = slot
+        return h and expires > now and head <= pos + self.data_size
+
+    def _lookup(self, h, key, now):
+        """Return (slot number, slot) of the live record for `key`, or (None, None)."""
+        head = self._position()
+        for n in self._probe(h):
+            slot = SLOT.unpack_from(self.mm, self._slot_offset(n))
+            if slot[0] == h and self._valid(slot, now, head):
+                start = self._record_offset(slot[1])
+                rh, klen, vlen = RECORD.unpack_from(self.mm, start)
+                start += RECORD.size
+                if rh == h and self.mm[start:start + klen] == key:
+                    return n, slot
+        return None, None
+
+    def _value(self, slot, key):
+        start = self._record_offset(slot[1]) + RECORD.size + len(key)
+        vlen = slot[2] - RECORD.size - len(key)
+        return pickle.load(StringIO(buffer(self.mm, start, vlen)))
+
+    def _append(self, h, key, data):
+        """Write a record at the head, returning its position and length."""
+        length = RECORD.size + len(key) + len(data)
+        pos = self._position()
+        if pos % self.data_size + length > self.data_size:
+            # records never wrap, skip the tail of the ring
+            pos += self.data_size - pos % self.data_size
+
+        start = self._record_offset(pos)
+        RECORD.pack_into(self.mm, start, h, len(key), len(data))
+        start += RECORD.size
+        self.mm[start:start + len(key)] = key
+        start += len(key)
+        self.mm[start:start + len(data)] = data
+        HEADER.pack_into(self.mm, 0, MAGIC, self.slots, self.data_size, pos + length)
+        return pos, length
+
+    def get(self, h, key, default=None):
+        now = int(time.time())
+        with self.locked():
+            n, slot = self._lookup(h, key, now)
+            if slot is None:
+                return default
+            value = self._value(slot, key)
+            # access times are in seconds, so a hot key only takes the
+            # exclusive lock to record them about once a second
+            touch = slot[4] != now
+            promote = self._position() - slot[1] > self.data_size * 3 / 4
+
+        if touch or promote:
+            with self.locked(exclusive=True):
+                n, current = self._lookup(h, key, now)
+                if current is not None and current[1] == slot[1]:
+                    pos, length = current[1], current[2]
+                    if promote:
+                        start = self._record_offset(pos) + RECORD.size + len(key)
+                        data = self.mm[start:start + length - RECORD.size - len(key)]
+                        pos, length = self._append(h, key, data)
+                    SLOT.pack_into(self.mm, self._slot_offset(n), h, pos, length, current[3], now)
+
+        return value
+
+    def _set(self, h, key, data, expires, now):
+        """Store already pickled `data`, the caller must hold the exclusive lock."""
+        head = self._position()
+        n, slot = self._lookup(h, key, now)
+        victim = n
+        if victim is None:
+            victim_access = None
+            for n in self._probe(h):
+                slot = SLOT.unpack_from(self.mm, self._slot_offset(n))
+                if not self._valid(slot, now, head):
+                    victim = n
+                    break
+                # least recently used, then oldest written
+                if victim is None or (slot[4], slot[1]) < victim_access:
+                    victim, victim_access = n, (slot[4], slot[1])
+
+        pos, length = self._append(h, key, data)
+        SLOT.pack_into(self.mm, self._slot_offset(victim), h, pos, length, expires, now)
+
+    def set(self, h, key, data, expires):
+        now = int(time.time())
+        with self.locked(exclusive=True):
+            self._set(h, key, data, expires, now)
+
+    def add(self, h, key, data, expires):
+        now = int(time.time())
+        with self.locked(exclusive=True):
+            if self._lookup(h, key, now)[1] is not None:
+                return False
+            self._set(h, key, data, expires, now)
+            return True
+
+    def delete(self, h, key):
+        with self.locked(exclusive=True):
+            n, slot = self._lookup(h, key, int(time.time()))
+            if n is not None:
+                SLOT.pack_into(self.mm, self._slot_offset(n), 0, 0, 0, 0, 0)
+
+    def clear(self):
+        with self.locked(exclusive=True):
+            self.format()
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+class MmapShardCache(BaseCache):
+    def __init__(self, dir, params):
+        BaseCache.__init__(self, params)
+        options = params.get('OPTIONS', {})
+        self._dir = dir
+        self._shard_count = int(options.get('SHARDS', 8))
+        self._shard_size = int(options.get('SHARD_SIZE', 32*1024*1024))
+        self._slots = int(options.get('SLOTS', 8192))
+        self._shards = None
+        self._pid = None
+        if not os.path.exists(self._dir):
+            os.makedirs(self._dir)
+
+    def _shard_list(self):
+        # a forked worker shares its parent's open files, and with them the
+        # flocks, so every process has to map the shards itself
+        if self._pid != os.getpid():
+            if self._shards is not None:
+                for shard in self._shards:
+                    shard.close()
+            self._shards = [
+                Shard(os.path.join(self._dir, 'shard-%02i.dat' % n), self._shard_size, self._slots)
+                for n in range(self._shard_count)]
+            self._pid = os.getpid()
+        return self._shards
+
+    def _locate(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        h = struct.unpack('<Q', md5_constructor(key).digest()[:8])[0] or 1
+        return self._shard_list()[(h >> 32) % self._shard_count], h, key
+
+    def _pickle(self, shard, value, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > shard.data_size / 4:
+            # would push most of the shard out, not worth caching
+            return None, None
+        return data, int(time.time() + timeout)
+
+    def add(self, key, value, timeout=None, version=None):
+        shard, h, key = self._locate(key, version)
+        data, expires = self._pickle(shard, value, timeout)
+        if data is None:
+            return False
+        return shard.add(h, key, data, expires)
+
+    def get(self, key, default=None, version=None):
+        shard, h, key = self._locate(key, version)
+        return shard.get(h, key, default)
+
+    def set(self, key, value, timeout=None, version=None):
+        shard, h, key = self._locate(key, version)
+        data, expires = self._pickle(shard, value, timeout)
+        if data is None:
+            shard.delete(h, key)
+        else:
+            shard.set(h, key, data, expires)
+
+    def delete(self, key, version=None):
+        shard, h, key = self._locate(key, version)
+        shard.delete(h, key)
+
+    def has_key(self, key, version=None):
+        return self.get(key, version=version) is not None
+
+    def clear(self):
+        for shard in self._shard_list():
+            shard.clear()
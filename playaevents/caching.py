@@ -0,0 +1,442 @@
+"""
+Cache helpers shared by the model managers and the API.
+
+Cached lists are keyed by a per-year "generation" number.  Any write to a
+PlayaEvent, Occurrence, ThemeCamp, ArtInstallation or street bumps the
+generation for its year (and the cross-year generation), so the old entries
+are simply never read again and age out of the backend on their own.
+
+Misses are computed "single-flight": one worker takes a lease on the key and
+recomputes it, while the others keep serving the previous value or wait
+briefly for the new one instead of all running the same query.
+
+Lists can also be given a soft timeout shorter than their hard one.  Past the
+soft timeout the stale value is still returned immediately and the refresh
+runs on a small thread pool inside the worker; only past the hard timeout does
+a request block on the recompute.
+
+In front of the shared backend sits a small in-process LRU, so hot keys don't
+cost a file read and an unpickle of a multi-megabyte list on every request.
+"""
+import cPickle as pickle
+import errno
+import os
+import threading
+import time
+import keyedcache
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+from django.db import connection
+from django.core.cache.backends.filebased import FileBasedCache
+from django.utils.hashcompat import md5_constructor
+from keyedcache import NotCachedError, cache_delete, cache_enabled, cache_get, cache_set, cache_key
+from playaevents.instrumentation import count
+import logging
+
+log = logging.getLogger(__name__)
+
+ALL_YEARS = 'all'
+
+# how long a worker may hold the lease on a key before others assume it died
+LEASE_TIMEOUT = getattr(settings, 'CACHE_LEASE_TIMEOUT', 30)
+# how long other workers wait for the leaseholder when there is nothing to serve
+LEASE_WAIT = getattr(settings, 'CACHE_LEASE_WAIT', 5)
+# how long an expired value is kept around to be served during a recompute
+STALE_GRACE = getattr(settings, 'CACHE_STALE_GRACE', 60*10)
+# threads per worker for stale-while-revalidate refreshes
+REFRESH_THREADS = getattr(settings, 'CACHE_REFRESH_THREADS', 2)
+# size and per-key lifetime of the in-process tier
+LOCAL_MAX_BYTES = getattr(settings, 'CACHE_LOCAL_MAX_BYTES', 64*1024*1024)
+LOCAL_TIMEOUT = getattr(settings, 'CACHE_LOCAL_TIMEOUT', 60)
+
+# generations are cheap to keep, and losing one only costs a cold cache
+GENERATION_TIMEOUT = 60*60*24*30
+
+class LocalCache(object):
+    """Thread-safe, size-bounded LRU of pickleable values, with a TTL per key.
+
+    Sizes are the pickled size of the value, i.e. roughly what the shared
+    backend stores for it; callers which have the value pickled already
+    pass its size, otherwise it is pickled to measure it.  Values bigger
+    than the whole cache are not kept.
+    """
+
+    def __init__(self, max_bytes, timeout):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, size, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            if expires < time.time():
+                self.size -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            # re-inserting moves the key to the most recently used end
+            self._entries[key] = (expires, size, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None, size=None):
+        if timeout is None:
+            timeout = self.timeout
+        if size is None:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            self.delete(key)
+            if size > self.max_bytes:
+                return
+
+            while self._entries and self.size + size > self.max_bytes:
+                old_key, (expires, old_size, old_value) = self._entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+
+            self._entries[key] = (time.time() + timeout, size, value)
+            self.size += size
+
+    def delete(self, key):
+        with self._lock:
+            try:
+                expires, size, value = self._entries.pop(key)
+                self.size -= size
+            except KeyError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys' : len(self._entries),
+                'bytes' : self.size,
+                'max_bytes' : self.max_bytes,
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'evictions' : self.evictions,
+                'expirations' : self.expirations,
+                }
+
+local_cache = LocalCache(LOCAL_MAX_BYTES, LOCAL_TIMEOUT)
+
+def _year_id(year):
+    """Normalize a Year instance, Year pk or None to a generation key part."""
+    if year is None:
+        return ALL_YEARS
+    return getattr(year, 'pk', year)
+
+def _new_generation():
+    # time based, so a generation which fell out of the cache never
+    # restarts at a number whose old entries may still be around
+    return int(time.time() * 1000)
+
+def year_generation(year=None):
+    """Return the current cache generation for `year`, None meaning all years."""
+    key = cache_key('generation', _year_id(year))
+    try:
+        generation = cache_get(key)
+    except NotCachedError:
+        generation = _new_generation()
+        cache_set(key, value=generation, length=GENERATION_TIMEOUT, skiplog=True)
+
+    return generation
+
+def bump_generation(year=None):
+    if not cache_enabled():
+        return None
+
+    key = cache_key('generation', _year_id(year))
+    generation = max(cache_get(key, default=0) + 1, _new_generation())
+    cache_set(key, value=generation, length=GENERATION_TIMEOUT)
+    return generation
+
+def year_id(year_year):
+    """The pk of the Year named `year_year` (e.g. '2011'), or None if there is none."""
+    from playaevents.models import Year
+
+    def _lookup():
+        ids = list(Year.objects.filter(year=year_year).values_list('pk', flat=True)[:1])
+        return ids and ids[0] or None
+
+    return get_or_compute(cache_key('year_id', year_year), _lookup)
+
+_deferred = threading.local()
+
+@contextmanager
+def deferred_invalidation():
+    """Within the block, invalidate each year once on the way out instead of on every save.
+
+    For batch writes, which would otherwise bump the same generation once
+    per row.
+    """
+    if getattr(_deferred, 'years', None) is not None:
+        # nested, the outer block invalidates
+        yield
+        return
+
+    _deferred.years = set()
+    try:
+        yield
+    finally:
+        years, _deferred.years = _deferred.years, None
+        for year in years:
+            invalidate_year(year)
+
+def invalidate_year(year):
+    """Make every cached list for `year`, and every cross-year list, stale."""
+    years = getattr(_deferred, 'years', None)
+    if years is not None:
+        years.add(_year_id(year))
+        return
+
+    log.debug('invalidating cached lists for year %s', _year_id(year))
+    if year is not None and year != ALL_YEARS:
+        bump_generation(year)
+    bump_generation(ALL_YEARS)
+
+def invalidate_instance(sender, instance, **kwargs):
+    """post_save/post_delete receiver for models carrying a `year` foreign key."""
+    invalidate_year(instance.year_id)
+
+def invalidate_own_year(sender, instance, **kwargs):
+    """post_save/post_delete receiver for Years."""
+    key = cache_key('year_id', instance.year)
+    cache_delete(key)
+    local_cache.delete(key)
+    invalidate_year(instance.pk)
+
+def invalidate_occurrence(sender, instance, **kwargs):
+    """post_save/post_delete receiver for swingtime Occurrences."""
+    from playaevents.models import PlayaEvent
+
+    years = PlayaEvent.objects.filter(pk=instance.event_id).values_list('year', flat=True)
+    if years:
+        invalidate_year(years[0])
+    else:
+        # the event is gone too (cascading delete), its own signal
+        # takes care of the year
+        invalidate_year(None)
+
+
+class FileLease(object):
+    """A lease held as an O_EXCL lock file, for the file based cache backend."""
+
+    def __init__(self, backend, key, timeout):
+        leasedir = backend._dir.rstrip(os.sep) + '-leases'
+        if not os.path.exists(leasedir):
+            try:
+                os.makedirs(leasedir)
+            except OSError:
+                pass
+        self.fname = os.path.join(leasedir, md5_constructor(key).hexdigest())
+        self.timeout = timeout
+
+    def acquire(self):
+        for attempt in (1, 2):
+            try:
+                os.close(os.open(self.fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    # can't lock, so don't keep everyone waiting on us
+                    log.warn('could not create lease file %s: %s', self.fname, e)
+                    return True
+            try:
+                if os.path.getmtime(self.fname) + self.timeout > time.time():
+                    return False
+                log.debug('breaking expired lease %s', self.fname)
+                os.unlink(self.fname)
+            except OSError:
+                # released while we looked at it, try again
+                pass
+        return False
+
+    def release(self):
+        try:
+            os.unlink(self.fname)
+        except OSError:
+            pass
+
+class CacheLease(object):
+    """A lease held as an `add`-ed key, for shared backends like memcached."""
+
+    def __init__(self, backend, key, timeout):
+        self.backend = backend
+        self.key = key + '::lease'
+        self.timeout = timeout
+        self.token = '%i:%f' % (os.getpid(), time.time())
+
+    def acquire(self):
+        return self.backend.add(self.key, self.token, self.timeout)
+
+    def release(self):
+        if self.backend.get(self.key) == self.token:
+            self.backend.delete(self.key)
+
+def acquire_lease(key, timeout=None):
+    """Try to take the recompute lease for `key`, returning it or None if held elsewhere."""
+    backend = keyedcache.cache
+    if timeout is None:
+        timeout = LEASE_TIMEOUT
+
+    if isinstance(backend, FileBasedCache):
+        lease = FileLease(backend, key, timeout)
+    else:
+        lease = CacheLease(backend, key, timeout)
+
+    if lease.acquire():
+        return lease
+    return None
+
+def _wait_for(key, wait):
+    deadline = time.time() + wait
+    pause = 0.05
+    while time.time() < deadline:
+        time.sleep(pause)
+        entry = _shared_entry(key)[0]
+        if entry is not None:
+            return entry
+        pause = min(pause * 2, 0.5)
+    return None
+
+_POOL = None
+_POOL_PID = None
+
+def _refresh_pool():
+    """Return this process' refresh pool, made on first use so forked workers each get their own."""
+    global _POOL, _POOL_PID
+    if _POOL is None or _POOL_PID != os.getpid():
+        _POOL = ThreadPool(REFRESH_THREADS)
+        _POOL_PID = os.getpid()
+    return _POOL
+
+def _store(key, entry, hard_length):
+    # the shared tier keeps the value pickled, so both tiers know its size
+    # without pickling it again
+    expires, value = entry
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    cache_set(key, value=(expires, data), length=hard_length)
+    local_cache.set(key, entry, min(LOCAL_TIMEOUT, hard_length), size=len(data))
+
+def _shared_entry(key):
+    """Return the (expires, value) entry for `key` in the shared tier and its pickled size, or (None, 0)."""
+    shared = cache_get(key, default=None)
+    if shared is None:
+        return None, 0
+    expires, data = shared
+    return (expires, pickle.loads(data)), len(data)
+
+def _compute_and_store(key, compute, soft_length, hard_length):
+    value = compute()
+    _store(key, (time.time() + soft_length, value), hard_length)
+    return value
+
+def _get_entry(key, hard_length):
+    """Return the (expires, value) entry for `key`, from the local tier if it is fresh there."""
+    entry = local_cache.get(key)
+    if entry is not None and time.time() < entry[0]:
+        return entry
+
+    # missing or stale locally, another worker may have refreshed it
+    shared, size = _shared_entry(key)
+    if shared is None:
+        return entry
+
+    local_cache.set(key, shared, min(LOCAL_TIMEOUT, hard_length), size=size)
+    return shared
+
+def _refresh(key, compute, soft_length, hard_length, lease):
+    try:
+        try:
+            _compute_and_store(key, compute, soft_length, hard_length)
+            log.debug('refreshed %s in the background', key)
+        except Exception:
+            log.exception('background refresh of %s failed', key)
+    finally:
+        lease.release()
+        # each pool thread gets its own connection, don't leave it open
+        connection.close()
+
+def get_or_compute(key, compute, length=None, soft_length=None):
+    """Return the value cached under `key`, calling `compute` single-flight on a miss.
+
+    Without `soft_length`, values are kept STALE_GRACE seconds longer than
+    `length`, so while one worker recomputes an expired key the others
+    return the previous value.
+
+    With `soft_length`, `length` is the hard timeout.  Once a value is older
+    than `soft_length` it is still returned, and whoever gets the lease
+    schedules the recompute on the refresh pool.
+
+    When there is no value at all, the workers without the lease wait up to
+    LEASE_WAIT seconds for the leaseholder, then compute it themselves.
+
+    Entries are kept in `local_cache` for up to LOCAL_TIMEOUT seconds.
+    """
+    if not cache_enabled():
+        return compute()
+
+    if length is None:
+        length = keyedcache.CACHE_TIMEOUT
+
+    background = soft_length is not None
+    if background:
+        hard_length = length
+    else:
+        soft_length = length
+        hard_length = length + STALE_GRACE
+
+    entry = _get_entry(key, hard_length)
+    if entry is not None:
+        expires, value = entry
+        if time.time() < expires:
+            count('cache_hits')
+            return value
+
+    lease = acquire_lease(key)
+    if entry is not None:
+        if lease is None:
+            log.debug('serving previous value of %s during recompute', key)
+            count('cache_stale')
+            return entry[1]
+
+        if background:
+            log.debug('serving stale %s, refreshing in the background', key)
+            _refresh_pool().apply_async(_refresh,
+                (key, compute, soft_length, hard_length, lease))
+            count('cache_stale')
+            return entry[1]
+
+    elif lease is None:
+        log.debug('waiting for %s to be computed elsewhere', key)
+        entry = _wait_for(key, LEASE_WAIT)
+        if entry is not None:
+            count('cache_waits')
+            return entry[1]
+        log.debug('gave up waiting on %s', key)
+
+    count('cache_misses')
+    try:
+        value = _compute_and_store(key, compute, soft_length, hard_length)
+    finally:
+        if lease is not None:
+            lease.release()
+
+    return value
@@ -0,0 +1,184 @@
+"""
+Per-request counters, aggregated into per-worker histograms by view.
+
+`RequestTimingMiddleware` (see `playaevents.middleware`) opens a
+`RequestCounters` for each request.  While it is open, every database query
+made by the thread is counted and timed, and code of interest counts events
+against it with `count()`, e.g. the cache hits and misses of
+`get_or_compute` and the API's render memo.  When the response goes out, the
+counters are added to `request_stats` under the request's URL name, or for
+the unnamed API urls the name of their handler; the staff-only
+request stats view shows them.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+_current = threading.local()
+
+class RequestCounters(object):
+    """What one request did."""
+    __slots__ = ('start', 'name', 'queries', 'db_time', 'events')
+
+    def __init__(self):
+        self.start = time.time()
+        self.name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.events = {}
+
+def begin():
+    counters = _current.counters = RequestCounters()
+    return counters
+
+def end():
+    counters = getattr(_current, 'counters', None)
+    _current.counters = None
+    return counters
+
+def current():
+    """The counters of the request this thread is serving, or None."""
+    return getattr(_current, 'counters', None)
+
+def count(event, n=1):
+    """Count `n` of `event` against the current request, if there is one."""
+    counters = getattr(_current, 'counters', None)
+    if counters is not None:
+        counters.events[event] = counters.events.get(event, 0) + n
+
+class TimedCursor(object):
+    """A cursor which adds its queries to the current request's counters."""
+
+    def __init__(self, cursor, counters):
+        self.cursor = cursor
+        self.counters = counters
+
+    def _timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.counters.queries += 1
+            self.counters.db_time += time.time() - start
+
+    def execute(self, sql, params=()):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+_installed = False
+
+def install_cursor_timing():
+    """Time the queries of every connection while a request is being counted, once per process.
+
+    Django only records queries with DEBUG, and then keeps their SQL, so
+    this wraps the cursors itself.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    from django.db.backends import BaseDatabaseWrapper
+    cursor = BaseDatabaseWrapper.cursor
+
+    def timed_cursor(self):
+        counters = getattr(_current, 'counters', None)
+        if counters is None:
+            return cursor(self)
+        return TimedCursor(cursor(self), counters)
+
+    BaseDatabaseWrapper.cursor = timed_cursor
+
+class Histogram(object):
+    """Counts of values falling at or under each of `bounds`, or above them all."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def stats(self):
+        buckets = [('<=%s' % bound, n) for bound, n in zip(self.bounds, self.counts)]
+        buckets.append(('>%s' % self.bounds[-1], self.counts[-1]))
+        return {
+            'count' : self.total,
+            'mean' : self.total and float(self.sum) / self.total or 0,
+            'max' : self.max,
+            'buckets' : [bucket for bucket in buckets if bucket[1]],
+            }
+
+MS_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BOUNDS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BOUNDS = (1024, 10*1024, 100*1024, 1024*1024, 10*1024*1024)
+
+class ViewStats(object):
+
+    def __init__(self):
+        self.wall_ms = Histogram(MS_BOUNDS)
+        self.db_ms = Histogram(MS_BOUNDS)
+        self.queries = Histogram(QUERY_BOUNDS)
+        self.bytes = Histogram(BYTES_BOUNDS)
+        self.statuses = {}
+        self.events = {}
+
+    def add(self, counters, wall, status, size):
+        self.wall_ms.add(wall * 1000)
+        self.db_ms.add(counters.db_time * 1000)
+        self.queries.add(counters.queries)
+        if size is not None:
+            self.bytes.add(size)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        for event, n in counters.events.iteritems():
+            self.events[event] = self.events.get(event, 0) + n
+
+    def stats(self):
+        return {
+            'wall_ms' : self.wall_ms.stats(),
+            'db_ms' : self.db_ms.stats(),
+            'queries' : self.queries.stats(),
+            'bytes' : self.bytes.stats(),
+            'statuses' : self.statuses,
+            'events' : self.events,
+            }
+
+class RequestStats(object):
+    """The `ViewStats` of each URL name served by this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, counters, status, size):
+        wall = time.time() - counters.start
+        name = counters.name or '<unresolved>'
+        with self._lock:
+            view = self._views.get(name)
+            if view is None:
+                view = self._views[name] = ViewStats()
+            view.add(counters, wall, status, size)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict((name, view.stats()) for name, view in self._views.iteritems())
+
+request_stats = RequestStats()
@@ -0,0 +1,69 @@
+"""
+ Command to compare the API's formats on a year's events
+"""
+
+import gzip
+import time
+from cStringIO import StringIO
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpRequest, HttpResponse
+from optparse import make_option
+from piston.emitters import Emitter
+from piston.handler import typemapper
+from playaevents.api import handlers
+from playaevents.utilities import get_current_year
+
+def _gzipped_size(content):
+    buf = StringIO()
+    gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6)
+    gz.write(content)
+    gz.close()
+    return len(buf.getvalue())
+
+class Command(BaseCommand):
+
+    help = "Time the rendering of a year's anonymous event list in each API format, and compare sizes"
+    option_list = BaseCommand.option_list + (
+        make_option('--year', dest='year',
+                    default=get_current_year(),
+                    help='Year, default = this year'),
+        make_option('--format', dest='formats',
+                    action='append',
+                    help='Only this format, can be repeated, default json and msgpack'),
+        make_option('--repeat', dest='repeat',
+                    type='int', default=5,
+                    help='Renders per format, the fastest counts, default 5'),
+        )
+
+    def handle(self, *args, **options):
+        year = str(options['year'])
+        handler = handlers.AnonymousPlayaEventHandler()
+        request = HttpRequest()
+        request.method = 'GET'
+
+        data = handler.read(request, year_year=year)
+        if isinstance(data, HttpResponse):
+            raise CommandError('no events for %s' % year)
+
+        formats = options.get('formats') or [f for f in ('json', 'msgpack') if f in Emitter.EMITTERS]
+        print "%i events for %s" % (len(data), year)
+        print "%-10s %10s %12s %12s" % ('format', 'ms', 'bytes', 'gzipped')
+
+        for format in formats:
+            try:
+                emitter = Emitter.get(format)[0]
+            except ValueError:
+                raise CommandError('unknown format %s' % format)
+
+            best = None
+            for n in range(options['repeat']):
+                start = time.time()
+                content = emitter(data, typemapper, handler, handler.fields, True).render(request)
+                if isinstance(content, HttpResponse):
+                    content = ''.join(content)
+                elapsed = time.time() - start
+                best = min(best or elapsed, elapsed)
+
+            if isinstance(content, unicode):
+                content = content.encode('utf-8')
+            print "%-10s %10.1f %12i %12i" % (format, best * 1000, len(content), _gzipped_size(content))
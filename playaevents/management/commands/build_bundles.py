@@ -0,0 +1,31 @@
+"""
+ Command to build the offline SQLite bundle of a year
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from keyedcache import cache_enabled
+from playaevents.api import bundles
+from playaevents.utilities import get_current_year
+
+class Command(BaseCommand):
+
+    help = "Build the offline SQLite bundle of a year's events, camps, art and streets"
+    option_list = BaseCommand.option_list + (
+        make_option('--year', dest='years',
+                    action='append',
+                    help='Year, can be repeated, default = this year'),
+        )
+
+    def handle(self, *args, **options):
+        if not bundles.BUNDLE_DIR:
+            raise CommandError('API_BUNDLE_DIR is not set')
+        if not cache_enabled():
+            raise CommandError('bundles are keyed by the cache, which is disabled')
+
+        for year in options.get('years') or [get_current_year()]:
+            path = bundles.build_bundle(str(year))
+            if path:
+                print "built %s" % path
+            else:
+                print "no year %s" % year
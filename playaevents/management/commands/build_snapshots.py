@@ -0,0 +1,39 @@
+"""
+ Command to pre-render the anonymous API lists of a year
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from keyedcache import cache_enabled
+from playaevents.api import snapshots
+from playaevents.utilities import get_current_year
+
+class Command(BaseCommand):
+
+    help = "Build the API snapshots of a year's events, camps, art and streets"
+    option_list = BaseCommand.option_list + (
+        make_option('--year', dest='year',
+                    default=get_current_year(),
+                    help='Year, default = this year'),
+        make_option('--resource', dest='resources',
+                    action='append',
+                    help='Only this resource (%s), can be repeated' % ', '.join(sorted(snapshots.RESOURCES))),
+        )
+
+    def handle(self, *args, **options):
+        if not snapshots.SNAPSHOT_DIR:
+            raise CommandError('API_SNAPSHOT_DIR is not set')
+        if not cache_enabled():
+            raise CommandError('snapshots are keyed by the cache, which is disabled')
+
+        year = str(options['year'])
+        resources = options['resources'] or sorted(snapshots.RESOURCES)
+        for resource in resources:
+            if resource not in snapshots.RESOURCES:
+                raise CommandError('unknown resource %s' % resource)
+
+            path = snapshots.build_snapshot(resource, year)
+            if path:
+                print "built %s" % path
+            else:
+                print "no %s for %s" % (resource, year)
@@ -0,0 +1,48 @@
+"""
+ Command to merge the sampled request profiles and show where the time went
+"""
+
+import os
+import pstats
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from playaevents import profiling
+
+class Command(BaseCommand):
+
+    help = "Merge the sampled request profiles and list the functions taking the most time"
+    option_list = BaseCommand.option_list + (
+        make_option('--view', dest='view',
+                    help='Only the profiles of this view, may be a pattern like api:*'),
+        make_option('--limit', dest='limit', type='int', default=30,
+                    help='Number of functions to list, default = 30'),
+        make_option('--sort', dest='sort', default='cumulative',
+                    help='pstats sort key, default = cumulative'),
+        )
+
+    def handle(self, *args, **options):
+        if not profiling.PROFILE_DIR:
+            raise CommandError('PROFILE_DIR is not set')
+
+        try:
+            paths = profiling.profiles(options.get('view'))
+        except OSError:
+            paths = []
+        if not paths:
+            raise CommandError('no profiles in %s' % profiling.PROFILE_DIR)
+
+        by_view = {}
+        for path in paths:
+            match = profiling.FILE_RE.match(os.path.basename(path))
+            by_view.setdefault(match.group('view'), []).append(int(match.group('ms')))
+
+        print "%i profiles" % len(paths)
+        for view, times in sorted(by_view.items()):
+            times.sort()
+            print "  %-40s %5i requests, median %ims, max %ims" % (
+                view, len(times), times[len(times) // 2], times[-1])
+        print
+
+        stats = pstats.Stats(*paths)
+        stats.sort_stats(options.get('sort'))
+        stats.print_stats(options.get('limit'))
@@ -1,9 +1,13 @@
-"""A middleware which prevents non-logged-in acesss if settings.LOGGED_IN_ONLY is True.
+"""A middleware which prevents non-logged-in acesss if settings.LOGGED_IN_ONLY is True,
+one which counts what each request costs and one which profiles a sample of them.
 
 Based on "MaintenanceMode" at: http://code.google.com/p/django-maintenancemode/
 """
+import os
+import time
 from django.conf import settings
 from django.core import urlresolvers
+from playaevents import instrumentation, profiling
 
 from django.conf.urls import defaults
 defaults.handler503 = 'playaevents.views.logged_in_only'
@@ -29,3 +33,75 @@ class LoggedInMiddleware(object):
 
         callback, param_dict = resolver._resolve_special('503')
         return callback(request, **param_dict)
+
+class RequestTimingMiddleware(object):
+    """Counts each request's time, queries, cache use and response size by view,
+    see `playaevents.instrumentation`.  Goes first, so that it times the others.
+    """
+    def __init__(self):
+        instrumentation.install_cursor_timing()
+
+    def process_request(self, request):
+        instrumentation.begin()
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        counters = instrumentation.current()
+        if counters is not None:
+            counters.name = view_name(request, view_func)
+        return None
+
+    def process_response(self, request, response):
+        counters = instrumentation.end()
+        if counters is not None:
+            instrumentation.request_stats.add(counters, response.status_code, response_size(response))
+        return response
+
+class ProfilingMiddleware(object):
+    """Profiles a sample of the requests, and those staff ask for with ?profile=1,
+    see `playaevents.profiling`.  Goes last, so that it starts right before the view.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        name = view_name(request, view_func)
+        if profiling.sampled(name) or profiling.asked_for(request):
+            request._profile = (profiling.start(), name, time.time())
+        return None
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is not None:
+            del request._profile
+            path = profiling.save(*profile)
+            if path and profiling.asked_for(request):
+                response['X-Profile'] = os.path.basename(path)
+        return response
+
+def view_name(request, view_func):
+    """The handler of an API resource, else the URL name of `request`, else the view's name."""
+    try:
+        return request._view_name
+    except AttributeError:
+        name = request._view_name = _view_name(request, view_func)
+        return name
+
+def _view_name(request, view_func):
+    # before the URL name, which for the unnamed API urls is the resource's class
+    handler = getattr(view_func, 'handler', None)
+    if handler is not None:
+        return 'api:%s' % handler.__class__.__name__
+
+    try:
+        name = urlresolvers.resolve(request.path_info).url_name
+    except urlresolvers.Resolver404:
+        name = None
+    if name:
+        return name
+    return '%s.%s' % (view_func.__module__, getattr(view_func, '__name__', view_func.__class__.__name__))
+
+def response_size(response):
+    """The length of the body of `response`, None when it can only be told by reading it."""
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    if response._is_string:
+        return len(response.content)
+    return None
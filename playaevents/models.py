@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.contrib.auth.models import User
-from swingtime.models import Event
-from datetime import timedelta
-from keyedcache import NotCachedError, cache_get, cache_set, cache_key
+from swingtime.models import Event, Occurrence
+from datetime import datetime, timedelta
+from keyedcache import cache_key
+from playaevents.caching import get_or_compute, year_generation, invalidate_instance, invalidate_occurrence, invalidate_own_year
+from playaevents.records import event_records, camp_records
 import logging
 log = logging.getLogger(__file__)
 
@@ -66,50 +70,48 @@ class TimeStreet(models.Model):
         return self.year.year + ":" + self.name
 
 
+def _get_and_cache(manager, name, build, fields=None, **kwargs):
+    """Return the records for the `manager` objects matching `kwargs`, cached for one day.
+
+    `build` turns the queryset into the list of compact records which is
+    cached, see `playaevents.records`, reading only `fields` when given.
+    After CACHE_LIST_SOFT_TIMEOUT the list is refreshed in the background
+    while the stale one keeps being served.
+    """
+    if fields is not None:
+        fields = tuple(sorted(fields))
+        key = cache_key(name, 'records', year_generation(kwargs.get('year')), fields, **kwargs)
+    else:
+        key = cache_key(name, 'records', year_generation(kwargs.get('year')), **kwargs)
+    log.debug('key = %s', key)
+
+    def _query():
+        log.debug('getting %s from db', name)
+        if kwargs:
+            results = manager.filter(**kwargs)
+        else:
+            results = manager.all()
+        return build(results, fields)
+
+    return get_or_compute(key, _query,
+                          length=getattr(settings, 'CACHE_LIST_HARD_TIMEOUT', 60*60*24),
+                          soft_length=getattr(settings, 'CACHE_LIST_SOFT_TIMEOUT', 60*15))
+
+
 class ThemeCampManager(models.Manager):
     """Manager which filters out list_online=False"""
 
     def get_query_set(self):
         return super(ThemeCampManager, self).get_query_set().filter(list_online=True)
 
-    def get_and_cache(self, **kwargs):
-        key = cache_key('ThemeCamp', 'all', **kwargs)
-        log.debug('key = %s', key)
-        try:
-            results = cache_get(key)
-            log.debug('got all camps from cache')
-        except NotCachedError:
-            log.debug('getting camps from db')
-            if kwargs:
-                results = self.filter(**kwargs)
-            else:
-                results = self.all()
-
-            results = list(results)
-            cache_set(key, value=results, length=60*60*24) # set for one day
-
-        return results
+    def get_and_cache(self, fields=None, **kwargs):
+        return _get_and_cache(self, 'ThemeCamp', camp_records, fields, **kwargs)
 
 class ThemeCampAllManager(models.Manager):
     """Manager which does not filter out list_online=False"""
 
-    def get_and_cache(self, **kwargs):
-        key = cache_key('ThemeCampAll', 'all', **kwargs)
-        log.debug('key = %s', key)
-        try:
-            results = cache_get(key)
-            log.debug('got all camps from cache')
-        except NotCachedError:
-            log.debug('getting camps from db')
-            if kwargs:
-                results = self.filter(**kwargs)
-            else:
-                results = self.all()
-
-            results = list(results)
-            cache_set(key, value=results, length=60*60*24) # set for one day
-
-        return results
+    def get_and_cache(self, fields=None, **kwargs):
+        return _get_and_cache(self, 'ThemeCampAll', camp_records, fields, **kwargs)
 
 class ThemeCamp(models.Model):
     name = models.CharField(max_length=100)
@@ -126,6 +128,7 @@ class ThemeCamp(models.Model):
     time_address = models.TimeField(null=True, blank=True)
     bm_fm_id = models.IntegerField(null=True,blank=True)
     deleted = models.NullBooleanField(null=True, blank=True, default=False)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     # make the default "objects" return just public results
     all_objects = ThemeCampAllManager()
@@ -158,6 +161,7 @@ class ArtInstallation(models.Model):
     distance = models.IntegerField(null=True, blank=True)
     location_string = models.CharField(max_length=50, null=True, blank=True)
     bm_fm_id = models.IntegerField(null=True,blank=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ('year','name',)
@@ -173,22 +177,8 @@ class ArtInstallation(models.Model):
         })
 
 class PlayaEventManager(models.Manager):
-    def get_and_cache(self, **kwargs):
-        key = cache_key('PlayaEvent', 'all', **kwargs)
-        try:
-            results = cache_get(key)
-            log.debug('got all events from cache')
-        except NotCachedError:
-            log.debug('getting events from db')
-            if kwargs:
-                results = self.filter(**kwargs)
-            else:
-                results = self.all()
-
-            results = list(results)
-            cache_set(key, value=results, length=60*60*24) # set for one day
-
-        return results
+    def get_and_cache(self, fields=None, **kwargs):
+        return _get_and_cache(self, 'PlayaEvent', event_records, fields, **kwargs)
 
     def search(self, searchtext, year=None):
         """Performs a full-text search on PlayaEvent and Event, returning the queryset."""
@@ -222,6 +212,7 @@ class PlayaEvent(Event):
   speaker_series = models.NullBooleanField(default=False)
   password_hint = models.CharField(max_length=120, blank=True, null=True)
   password = models.CharField(max_length=40, blank=True, null=True)
+  modified = models.DateTimeField(auto_now=True, db_index=True)
 
   objects = PlayaEventManager()
 
@@ -234,3 +225,20 @@ class PlayaEvent(Event):
           'playa_event_id':self.id,
           'year_year':self.year.year,
       })
+
+for model in (ThemeCamp, ArtInstallation, PlayaEvent, CircularStreet, TimeStreet):
+    post_save.connect(invalidate_instance, sender=model)
+    post_delete.connect(invalidate_instance, sender=model)
+
+post_save.connect(invalidate_own_year, sender=Year)
+post_delete.connect(invalidate_own_year, sender=Year)
+post_save.connect(invalidate_occurrence, sender=Occurrence)
+post_delete.connect(invalidate_occurrence, sender=Occurrence)
+
+def touch_event(sender, instance, **kwargs):
+    """Occurrences are part of their event, so changing one changes it."""
+    # update() rather than save(), which would run the event's signals again
+    PlayaEvent.objects.filter(pk=instance.event_id).update(modified=datetime.now())
+
+post_save.connect(touch_event, sender=Occurrence)
+post_delete.connect(touch_event, sender=Occurrence)
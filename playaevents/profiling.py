@@ -0,0 +1,106 @@
+"""
+Sampled cProfile runs of live requests.
+
+`ProfilingMiddleware` (see `playaevents.middleware`) profiles one in
+PROFILE_SAMPLE_EVERY of the requests for views matching PROFILE_VIEWS, and
+any request a staff member makes with ?profile=1.  Each profile is written
+to PROFILE_DIR as `<view>-<ms>ms-<epoch ms>-<pid>.prof`, keeping the newest
+PROFILE_KEEP of them; `manage.py profile_summary` merges and summarizes them.
+"""
+import cProfile
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from fnmatch import fnmatch
+from django.conf import settings
+import logging
+
+log = logging.getLogger(__name__)
+
+PROFILE_DIR = getattr(settings, 'PROFILE_DIR', None)
+# 0 profiles only the requests asking for it
+SAMPLE_EVERY = getattr(settings, 'PROFILE_SAMPLE_EVERY', 0)
+# patterns of the view names sampled, empty for all
+VIEWS = getattr(settings, 'PROFILE_VIEWS', ())
+KEEP = getattr(settings, 'PROFILE_KEEP', 200)
+
+_current = threading.local()
+
+FILE_RE = re.compile(r'^(?P<view>.+)-(?P<ms>\d+)ms-(?P<time>\d+)-(?P<pid>\d+)\.prof$')
+
+def _file_name(name):
+    """The view `name` as it is written in the profile filenames."""
+    return re.sub(r'[^\w.]', '_', name)
+
+def _file_pattern(pattern):
+    """The view name `pattern` as it matches the filenames, keeping its wildcards."""
+    return re.sub(r'[^\w.*?\[\]!]', '_', pattern)
+
+def sampled(name):
+    """Whether to profile this request for the view `name`, going by the sampling settings."""
+    if not SAMPLE_EVERY:
+        return False
+    if VIEWS and not any(fnmatch(name, pattern) for pattern in VIEWS):
+        return False
+    return random.randint(1, SAMPLE_EVERY) == 1
+
+def asked_for(request):
+    """Whether a staff member asked for `request` to be profiled."""
+    user = getattr(request, 'user', None)
+    return 'profile' in request.GET and user is not None and user.is_staff
+
+def start():
+    """Start profiling this thread, stopping a profile left running by a request which never finished."""
+    left = getattr(_current, 'profiler', None)
+    if left is not None:
+        left.disable()
+    profiler = _current.profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def save(profiler, name, started):
+    """Stop `profiler` and write its profile of a request to the view `name`, returning the path."""
+    profiler.disable()
+    _current.profiler = None
+    if not PROFILE_DIR:
+        return None
+
+    elapsed = int((time.time() - started) * 1000)
+    filename = '%s-%ims-%i-%i.prof' % (_file_name(name), elapsed, started * 1000, os.getpid())
+    path = os.path.join(PROFILE_DIR, filename)
+    try:
+        if not os.path.isdir(PROFILE_DIR):
+            os.makedirs(PROFILE_DIR)
+        fd, tmp = tempfile.mkstemp(dir=PROFILE_DIR, prefix='.tmp-')
+        os.close(fd)
+        profiler.dump_stats(tmp)
+        os.rename(tmp, path)
+        rotate()
+    except (IOError, OSError):
+        log.exception('could not write profile %s', path)
+        return None
+
+    log.debug('profiled %s in %ims to %s', name, elapsed, path)
+    return path
+
+def profiles(view=None):
+    """The paths of the profiles written, oldest first, only those of the view name or pattern `view` if given."""
+    if view is not None:
+        view = _file_pattern(view)
+    found = []
+    for filename in os.listdir(PROFILE_DIR):
+        match = FILE_RE.match(filename)
+        if match and (view is None or fnmatch(match.group('view'), view)):
+            found.append((int(match.group('time')), filename))
+    return [os.path.join(PROFILE_DIR, filename) for started, filename in sorted(found)]
+
+def rotate():
+    """Remove all but the newest KEEP profiles."""
+    for path in profiles()[:-KEEP or None]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
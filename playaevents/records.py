@@ -0,0 +1,163 @@
+"""
+Compact, read-only records of the models, for the cached lists.
+
+A pickled model instance carries its `_state`, every inherited field and a
+reference to its class, which makes the cached year lists big and slow to
+load.  These records are named tuples holding just what the API and the
+templates read, built with `values_list` queries, so a whole year of events
+is two queries and pickles as little more than its field values.
+
+Nested objects (the year, the hosting camp...) are shared between the
+records that point at them, and are pickled only once per list.
+"""
+from collections import namedtuple
+from operator import itemgetter
+from swingtime.models import Occurrence
+
+class Record(object):
+    """Marker base for the record classes, see `TimeAwareJSONEmitter`."""
+    __slots__ = ()
+
+def _record(name, fields):
+    return type(name, (Record, namedtuple(name, fields)), {'__slots__' : ()})
+
+YearRecord = _record('YearRecord', 'id year')
+RefRecord = _record('RefRecord', 'id name')
+StreetRecord = _record('StreetRecord', 'id name')
+EventTypeRecord = _record('EventTypeRecord', 'id abbr label')
+OccurrenceRecord = _record('OccurrenceRecord', 'start_time end_time')
+
+EventRecord = _record('EventRecord', (
+    'id', 'title', 'description', 'print_description', 'year', 'slug',
+    'event_type', 'hosted_by_camp', 'located_at_art', 'other_location', 'check_location',
+    'url', 'all_day', 'occurrence_set', 'contact_email', 'password_hint',
+    'password', 'moderation', 'list_online', 'list_contact_online',
+    'speaker_series'))
+
+CampRecord = _record('CampRecord', (
+    'id', 'year', 'name', 'description', 'url', 'contact_email', 'hometown',
+    'location_string', 'circular_street', 'time_address', 'list_online',
+    'deleted'))
+
+class _Interned(dict):
+    """Builds each nested record once, keyed by its id."""
+
+    def __init__(self, cls):
+        self.cls = cls
+
+    def ref(self, pk, *args):
+        if pk is None:
+            return None
+        try:
+            return self[pk]
+        except KeyError:
+            rec = self[pk] = self.cls(pk, *args)
+            return rec
+
+def _fetch(queryset, columns, fields, interned):
+    """Read the `columns` of `fields` (None for all of them, the id always) from `queryset`.
+
+    Returns (rows, getters): the values_list rows, and a function of a row
+    for each field of the record, in order, None for the fields not read.
+    A field read from several columns is an id and the values of the
+    nested record `interned[field]` it is made into.
+    """
+    select = []
+    getters = []
+    for name, cols in columns:
+        if not cols or (fields is not None and name != 'id' and name not in fields):
+            getters.append(None)
+        elif len(cols) == 1:
+            getters.append(itemgetter(len(select)))
+        else:
+            getters.append(_ref_getter(interned[name], len(select), len(cols)))
+        select.extend(cols)
+
+    return list(queryset.values_list(*select)), getters
+
+def _ref_getter(refs, i, n):
+    return lambda row: refs.ref(*row[i:i+n])
+
+def _build(cls, rows, getters):
+    none = lambda row: None
+    getters = [get or none for get in getters]
+    return [cls._make([get(row) for get in getters]) for row in rows]
+
+# the columns each record field is read from, in record order
+EVENT_COLUMNS = (
+    ('id', ('id',)),
+    ('title', ('title',)),
+    ('description', ('description',)),
+    ('print_description', ('print_description',)),
+    ('year', ('year__id', 'year__year')),
+    ('slug', ('slug',)),
+    ('event_type', ('event_type__id', 'event_type__abbr', 'event_type__label')),
+    ('hosted_by_camp', ('hosted_by_camp__id', 'hosted_by_camp__name')),
+    ('located_at_art', ('located_at_art__id', 'located_at_art__name')),
+    ('other_location', ('other_location',)),
+    ('check_location', ('check_location',)),
+    ('url', ('url',)),
+    ('all_day', ('all_day',)),
+    ('occurrence_set', ()),
+    ('contact_email', ('contact_email',)),
+    ('password_hint', ('password_hint',)),
+    ('password', ('password',)),
+    ('moderation', ('moderation',)),
+    ('list_online', ('list_online',)),
+    ('list_contact_online', ('list_contact_online',)),
+    ('speaker_series', ('speaker_series',)),
+    )
+
+CAMP_COLUMNS = (
+    ('id', ('id',)),
+    ('year', ('year__id', 'year__year')),
+    ('name', ('name',)),
+    ('description', ('description',)),
+    ('url', ('url',)),
+    ('contact_email', ('contact_email',)),
+    ('hometown', ('hometown',)),
+    ('location_string', ('location_string',)),
+    ('circular_street', ('circular_street__id', 'circular_street__name')),
+    ('time_address', ('time_address',)),
+    ('list_online', ('list_online',)),
+    ('deleted', ('deleted',)),
+    )
+
+def event_records(queryset, fields=None):
+    """Return a list of EventRecords for the PlayaEvents in `queryset`.
+
+    With `fields`, only those are read, the others are None; the
+    occurrences are only queried for 'occurrence_set'.
+    """
+    rows, getters = _fetch(queryset, EVENT_COLUMNS, fields, {
+        'year' : _Interned(YearRecord),
+        'event_type' : _Interned(EventTypeRecord),
+        'hosted_by_camp' : _Interned(RefRecord),
+        'located_at_art' : _Interned(RefRecord),
+        })
+
+    if rows and (fields is None or 'occurrence_set' in fields):
+        occurrences = {}
+        if queryset.query.can_filter():
+            events = queryset.values('pk')
+        else:
+            # a page: MySQL takes no LIMIT in an IN subquery, so the ids
+            # read, which are few enough to bind
+            events = [row[0] for row in rows]
+        occ = Occurrence.objects.filter(event__in=events).values_list(
+            'event', 'start_time', 'end_time')
+        for event_id, start, end in occ:
+            occurrences.setdefault(event_id, []).append(OccurrenceRecord(start, end))
+
+        getters[EventRecord._fields.index('occurrence_set')] = \
+            lambda row: tuple(occurrences.get(row[0], ()))
+
+    return _build(EventRecord, rows, getters)
+
+def camp_records(queryset, fields=None):
+    """Return a list of CampRecords for the ThemeCamps in `queryset`, see `event_records`."""
+    rows, getters = _fetch(queryset, CAMP_COLUMNS, fields, {
+        'year' : _Interned(YearRecord),
+        'circular_street' : _Interned(StreetRecord),
+        })
+    return _build(CampRecord, rows, getters)
@@ -0,0 +1,137 @@
+"""
+What is happening now, and next, in a year.
+
+Kiosks ask that over and over, so rather than range-filtering the
+occurrences in the database each time, every worker keeps an
+`IntervalIndex` of the year's listed occurrences, built from the cached
+event records and rebuilt when the year's cache generation changes.
+"""
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+import threading
+from playaevents.caching import year_generation
+from playaevents.models import PlayaEvent
+import logging
+
+log = logging.getLogger(__name__)
+
+# minutes ahead to look for what's next, by default
+NEXT_WITHIN = 60
+
+_start = itemgetter(0)
+_end = itemgetter(1)
+
+class _Node(object):
+    """
+    The intervals containing `center`, sorted by start and by end
+    descending, and the subtrees of those wholly before and after it.
+    """
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, intervals):
+        # a start, so at least that interval stays here
+        starts = sorted(map(_start, intervals))
+        self.center = center = starts[len(starts) // 2]
+
+        here, before, after = [], [], []
+        for interval in intervals:
+            if interval[1] <= center:
+                before.append(interval)
+            elif interval[0] > center:
+                after.append(interval)
+            else:
+                here.append(interval)
+
+        self.by_start = sorted(here, key=_start)
+        self.by_end = sorted(here, key=_end, reverse=True)
+        self.left = before and _Node(before) or None
+        self.right = after and _Node(after) or None
+
+class IntervalIndex(object):
+    """
+    A static index of (start, end, value) intervals, each covering
+    [start, end), answering which overlap an instant and which start
+    within a span in O(log n + k).
+    """
+    def __init__(self, intervals):
+        intervals = [i for i in intervals if i[0] < i[1]]
+        self.root = intervals and _Node(intervals) or None
+
+        self.by_start = sorted(intervals, key=_start)
+        self.starts = [i[0] for i in self.by_start]
+
+    def __len__(self):
+        return len(self.by_start)
+
+    def overlapping(self, when):
+        """The intervals with start <= `when` < end, by start."""
+        found = []
+        node = self.root
+        while node is not None:
+            if when < node.center:
+                # all of these end after the center, so after `when`
+                for interval in node.by_start:
+                    if interval[0] > when:
+                        break
+                    found.append(interval)
+                node = node.left
+            else:
+                # all of these start at or before the center
+                for interval in node.by_end:
+                    if interval[1] <= when:
+                        break
+                    found.append(interval)
+                node = node.right
+
+        found.sort(key=_start)
+        return found
+
+    def starting(self, begin, end):
+        """The intervals with `begin` <= start <= `end`, by start."""
+        return self.by_start[bisect_left(self.starts, begin):bisect_right(self.starts, end)]
+
+_indexes = {}
+_lock = threading.Lock()
+
+def year_index(year):
+    """
+    The `IntervalIndex` of the approved, listed occurrences of
+    `year` (a Year), the values being their event records.
+    """
+    generation = year_generation(year)
+    try:
+        built, index = _indexes[year.pk]
+        if built == generation:
+            return index
+    except KeyError:
+        pass
+
+    with _lock:
+        built, index = _indexes.get(year.pk, (None, None))
+        if built != generation:
+            # the same list the API serves, usually already cached
+            events = PlayaEvent.objects.get_and_cache(year=year, moderation='A', list_online=True)
+            index = IntervalIndex((o.start_time, o.end_time, event)
+                                  for event in events
+                                  for o in event.occurrence_set)
+            _indexes[year.pk] = (generation, index)
+            log.debug('indexed %i occurrences of %s', len(index), year)
+    return index
+
+def _events(intervals):
+    seen = set()
+    events = []
+    for start, end, event in intervals:
+        if event.id not in seen:
+            seen.add(event.id)
+            events.append(event)
+    return events
+
+def happening(year, when, within):
+    """
+    The event records of `year` going on at `when`, and those
+    starting after it and up to `within` (a timedelta) later.
+    """
+    index = year_index(year)
+    return (_events(index.overlapping(when)),
+            _events(i for i in index.starting(when, when + within) if i[0] > when))
@@ -35,12 +35,14 @@ SECRET_KEY = 'h7ny60*1c8(%4h(0c8@470sg$&1$m5jae*z(+m9ck3*!f%i91o'
 SITE_ID = 1
 
 MIDDLEWARE_CLASSES = (
+    'playaevents.middleware.RequestTimingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.middleware.doc.XViewMiddleware',
     'playaevents.api.middleware.ContentTypeMiddleware',
-    'playaevents.middleware.LoggedInMiddleware'
+    'playaevents.middleware.LoggedInMiddleware',
+    'playaevents.middleware.ProfilingMiddleware',
 )
 
 ROOT_URLCONF = 'playaevents.urls'
@@ -93,15 +95,70 @@ if not os.path.exists(CACHE_LOCATION):
 
 CACHES = {
     'default' : {
-        'BACKEND' : 'django.core.cache.backends.filebased.FileBasedCache',
+        'BACKEND' : 'playaevents.cachebackend.MmapShardCache',
         'LOCATION' : CACHE_LOCATION,
-        'TIMEOUT' : 60*60*6 # 6 hours
+        'TIMEOUT' : 60*60*6, # 6 hours
+        'OPTIONS' : {
+            'SHARDS' : 8,
+            'SHARD_SIZE' : 32*1024*1024,
+            'SLOTS' : 8192,
+            }
         }
     }
 
 CACHE_PREFIX = 'F'
 CACHE_TIMEOUT = 60*60*24
 
+# single-flight recomputes, see playaevents.caching
+CACHE_LEASE_TIMEOUT = 30
+CACHE_LEASE_WAIT = 5
+CACHE_STALE_GRACE = 60*10
+CACHE_REFRESH_THREADS = 2
+
+# in-process tier in front of CACHES['default'], per worker
+CACHE_LOCAL_MAX_BYTES = 64*1024*1024
+CACHE_LOCAL_TIMEOUT = 60
+
+# get_and_cache lists are served stale and refreshed in the background after
+# the soft timeout, requests only block on them after the hard timeout
+CACHE_LIST_SOFT_TIMEOUT = 60*15
+CACHE_LIST_HARD_TIMEOUT = 60*60*24
+
+# pre-rendered anonymous API lists, see playaevents.api.snapshots
+API_SNAPSHOT_DIR = os.path.join(PARENT_DIRNAME, 'snapshots')
+
+# offline SQLite bundles of a year, see playaevents.api.bundles; set
+# API_BUNDLE_URL to where the web server serves that directory to redirect there
+API_BUNDLE_DIR = os.path.join(PARENT_DIRNAME, 'bundles')
+
+# ?since= syncs look this many seconds further back than their token
+API_SYNC_OVERLAP = 60
+
+# ?limit= pages of the API lists
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+# most rows accepted by one POST to the bulk endpoints
+API_BULK_MAX_ROWS = 5000
+
+# how long rendered API responses are kept, 0 turns that off
+API_RENDER_MEMO_TIMEOUT = 60*60
+
+# API writes a second each user and each address may keep up, and in a burst,
+# see playaevents.api.throttle; a rate of 0 turns that limit off
+API_THROTTLE_USER_RATE = 5
+API_THROTTLE_USER_BURST = 60
+API_THROTTLE_IP_RATE = 10
+API_THROTTLE_IP_BURST = 120
+
+# cProfile one in PROFILE_SAMPLE_EVERY requests to the views matching
+# PROFILE_VIEWS (0 for none, staff can still ask with ?profile=1), keeping
+# the newest PROFILE_KEEP profiles; see playaevents.profiling
+PROFILE_DIR = os.path.join(PARENT_DIRNAME, 'profiles')
+PROFILE_SAMPLE_EVERY = 0
+PROFILE_VIEWS = ('playa_events_by_day', 'playa_event_search*', 'api:*')
+PROFILE_KEEP = 200
+
 DEBUG_TOOLBAR_CONFIG = { 'INTERCEPT_REDIRECTS': False }
 
 LOGGED_IN_ONLY = False
@@ -206,6 +206,12 @@ urlpatterns = patterns(
 
 
     url(r'^swingtime/', include('swingtime.urls')),
+
+    url(r'^stats/cache/$', 'playaevents.views.cache_stats',
+        name='cache_stats'),
+
+    url(r'^stats/requests/$', 'playaevents.views.request_stats',
+        name='request_stats'),
 )
 
 if settings.DEBUG:
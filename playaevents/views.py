@@ -1,8 +1,10 @@
 import calendar
 import itertools
 import logging
+import os
 
-from datetime import datetime, time
+from datetime import date, datetime, time, timedelta
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import AnonymousUser
 from django.core import urlresolvers
@@ -13,11 +15,21 @@ from django.utils.http import urlquote_plus
 from django.views.generic.create_update import delete_object
 from playaevents import forms as playaforms
 from playaevents import export
+from playaevents import instrumentation
+from playaevents.api.emitters import render_memo
+from playaevents.api.throttle import throttle
+from playaevents.caching import local_cache
 from playaevents.models import Year, CircularStreet, ThemeCamp, ArtInstallation, PlayaEvent
+from playaevents.schedule import NEXT_WITHIN, happening
 from playaevents.utilities import get_current_year
 from swingtime.conf import settings as swingtime_settings
 from swingtime.models import Occurrence
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 log = logging.getLogger(__name__)
 
 if swingtime_settings.CALENDAR_FIRST_WEEKDAY is not None:
@@ -182,7 +194,7 @@ def all_playa_events(request,
     if queryset:
         queryset = queryset._clone()
     else:
-        queryset = Occurrence.objects.select_related().filter(
+        queryset = Occurrence.objects.select_related('event__playaevent').filter(
             event__playaevent__moderation='A', event__playaevent__list_online=True)
 
     occurrences=queryset.filter(
@@ -251,7 +263,8 @@ def playa_events_by_day(request,
     if queryset:
         queryset = queryset._clone()
     else:
-        queryset = Occurrence.objects.select_related().filter(
+        # the template and the grouping below go through o.event.playaevent
+        queryset = Occurrence.objects.select_related('event__playaevent').filter(
             event__playaevent__moderation='A',
             event__playaevent__list_online=True)
 
@@ -280,6 +293,10 @@ def playa_events_by_day(request,
 
     all_day_occurrences = by_all_day.setdefault(True)
     timed_occurrences = by_all_day.setdefault(False)
+
+    happening_now = happening_next = None
+    if playa_day_dt == date.today():
+        happening_now, happening_next = happening(year, datetime.now(), timedelta(minutes=NEXT_WITHIN))
     curr_year = get_current_year()
     is_current_year = int(curr_year) == int(year_year)
 
@@ -304,7 +321,9 @@ def playa_events_by_day(request,
         prev_day_dt = previous_playa_day_dt,
         event_dates = event_date_list,
         all_day_occ = all_day_occurrences,
-        timed_occ = timed_occurrences)
+        timed_occ = timed_occurrences,
+        happening_now = happening_now,
+        happening_next = happening_next)
 
     log.debug('data: %s %s %s', playa_day, previous_playa_day, next_playa_day)
 
@@ -338,7 +357,7 @@ def playa_event_search(request, year_year):
     if year is not None:
         filters['start_time__range'] = (year.event_start, year.event_end)
 
-    occurrences = Occurrence.objects.select_related().filter(
+    occurrences = Occurrence.objects.select_related('event__playaevent').filter(
         **filters).order_by('start_time')
 
     occ = [(dt, list(items))
@@ -468,7 +487,15 @@ def playa_events_view_mine(
     user=request.user
     year = get_object_or_404(Year, year=year_year)
 
-    my_events = PlayaEvent.objects.filter(year=year, creator=user).order_by('moderation')
+    my_events = list(PlayaEvent.objects.filter(year=year, creator=user).order_by('moderation'))
+
+    # the occurrences of all of them in one query, rather than one per event
+    occurrences = {}
+    for occurrence in Occurrence.objects.filter(event__in=[e.id for e in my_events]):
+        occurrences.setdefault(occurrence.event_id, []).append(occurrence)
+    for event in my_events:
+        event.occurrences = occurrences.get(event.id, [])
+
     by_moderation=dict(
         [(moderation, list(items))
          for moderation, items
@@ -670,3 +697,24 @@ def temporary_unavailable(request, template_name='503.html'):
 
 def logged_in_only(request):
     return temporary_unavailable(request, 'logged_in_only.html')
+
+@staff_member_required
+def cache_stats(request):
+    """Counters of this worker's in-process cache tier, for sizing CACHE_LOCAL_MAX_BYTES,
+    of the API's rendered responses, for API_RENDER_MEMO_TIMEOUT, and of the
+    API writes let through and throttled."""
+    stats = local_cache.stats()
+    stats['pid'] = os.getpid()
+    stats['api_render_memo'] = render_memo.stats()
+    stats['api_throttle'] = throttle.stats()
+    return HttpResponse(json.dumps(stats), mimetype='application/json')
+
+@staff_member_required
+def request_stats(request):
+    """This worker's histograms of request time, queries, cache use and response size by view,
+    see `playaevents.instrumentation`."""
+    stats = {
+        'pid' : os.getpid(),
+        'views' : instrumentation.request_stats.stats(),
+        }
+    return HttpResponse(json.dumps(stats), mimetype='application/json')